@@ -0,0 +1,192 @@
+import argparse
+import logging
+import os
+import random
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import time
+import yaml
+from easydict import EasyDict
+
+from utils.logger import make_dirs
+
+
+def free_port_range(count, host='127.0.0.1', low=20000, high=32000, attempts=100):
+    """Find count consecutive free ports, returns the first one.
+
+    The range is picked below the Linux ephemeral port range so that
+    outgoing connections of other processes do not take the ports while the
+    cluster is starting.
+    """
+    for _ in range(attempts):
+        base = random.randrange(low, high - count)
+        sockets = []
+        try:
+            for port in range(base, base + count):
+                s = socket.socket()
+                sockets.append(s)
+                s.bind((host, port))
+            return base
+        except OSError:
+            continue
+        finally:
+            for s in sockets:
+                s.close()
+    raise RuntimeError("No free range of {} ports in [{}, {})".format(count, low, high))
+
+
+class Launcher():
+    def __init__(self, config_file, exp_name=None, ready_timeout=30, grace=15):
+        """Run all roles of run_simulation_v2.py as supervised subprocesses.
+
+        Every experiment gets its own free port range. The nodes are started
+        first and report through a pipe once their listener is bound, then
+        the environment and the client are started. Once the client is done
+        the nodes get grace seconds to save their logs before the cluster is
+        stopped.
+
+            config_file: path to config file
+            exp_name: name of experiment
+            ready_timeout: seconds to wait for the nodes to listen
+            grace: seconds the nodes get to stop after the client is done
+        """
+        with open(config_file) as f:
+            self.config = EasyDict(yaml.safe_load(f))
+        self.config_file = config_file
+        self.total_nodes = self.config.num_nodes
+        self.exp_name = "{}_{}".format(self.total_nodes, self.config.mab.algo) \
+                            if exp_name is None else exp_name
+        self.ready_timeout = ready_timeout
+        self.grace = grace
+        self.processes = {}
+
+        make_dirs('logs')
+        logging.basicConfig(level=logging.INFO,
+            format='%(asctime)s %(levelname)-8s [Launcher] %(funcName)s() %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S', handlers=[
+                logging.FileHandler('logs/launch_{}.log'.format(self.exp_name)),
+                logging.StreamHandler()
+                ]
+        )
+
+    def spawn(self, role, args=(), pass_fds=()):
+        """Start run_simulation_v2.py -t role, output goes to logs/<role>_<exp>.out"""
+        command = [
+            sys.executable, 'run_simulation_v2.py',
+            '-c', self.config_file,
+            '-t', role,
+            '-e', self.exp_name,
+            '--base_port', str(self.base_port),
+            '--client_port', str(self.client_port)
+        ] + list(args)
+        with open('logs/{}_{}.out'.format(role, self.exp_name), 'wb') as out:
+            self.processes[role] = subprocess.Popen(
+                command, stdout=out, stderr=subprocess.STDOUT, pass_fds=pass_fds
+            )
+        logging.info("[Status] Started {} (pid {})".format(role, self.processes[role].pid))
+
+    def start(self):
+        """Start the nodes, wait until they listen, then the env and client"""
+        start = time.time()
+        self.base_port = free_port_range(self.total_nodes + 1)
+        self.client_port = self.base_port + self.total_nodes
+        logging.info("[Status] Ports {}-{}, client port {}".format(
+            self.base_port, self.client_port - 1, self.client_port))
+
+        selector = selectors.DefaultSelector()
+        for i in range(self.total_nodes):
+            read_fd, write_fd = os.pipe()
+            self.spawn('node_{}'.format(i), ['--ready_fd', str(write_fd)], pass_fds=(write_fd,))
+            os.close(write_fd)
+            selector.register(read_fd, selectors.EVENT_READ, i)
+
+        # Every node writes to its pipe once listening, EOF means it exited
+        waiting = self.total_nodes
+        deadline = start + self.ready_timeout
+        while waiting:
+            events = selector.select(timeout=max(deadline - time.time(), 0))
+            if not events:
+                selector.close()
+                raise RuntimeError("{} node(s) not listening after {} secs".format(
+                    waiting, self.ready_timeout))
+            for key, _ in events:
+                data = os.read(key.fd, 64)
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                if not data:
+                    selector.close()
+                    raise RuntimeError("node_{} exited before listening".format(key.data))
+                waiting -= 1
+        selector.close()
+        logging.info("[Status] All nodes listening after {:.3f} secs".format(time.time() - start))
+
+        self.spawn('env')
+        self.spawn('client')
+
+    def wait(self):
+        """Supervise the cluster until the client is done, returns its exit code"""
+        client = self.processes['client']
+        while client.poll() is None:
+            for role, process in self.processes.items():
+                if role != 'client' and process.poll() is not None:
+                    logging.error("[Status] {} exited with code {}".format(role, process.returncode))
+                    return None
+            time.sleep(0.5)
+        logging.info("[Status] Client done with code {}".format(client.returncode))
+
+        # Let the nodes serve the last request and save their logs
+        time.sleep(self.grace)
+        return client.returncode
+
+    def stop(self):
+        """Stop every process, the environment is interrupted so that it saves"""
+        for role, process in self.processes.items():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT if role == 'env' else signal.SIGTERM)
+        for role, process in self.processes.items():
+            try:
+                process.wait(timeout=60 if role == 'env' else 5)
+            except subprocess.TimeoutExpired:
+                logging.error("[Status] Killing {}".format(role))
+                process.kill()
+                process.wait()
+        logging.info("[Status] Cluster stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Launch a local cluster')
+    parser.add_argument(
+        '-c',
+        '--config',
+        help='Path to config file'
+        )
+    parser.add_argument(
+        '-e',
+        '--exp_name',
+        type=str,
+        help='Name of experiment'
+    )
+    parser.add_argument(
+        '-g',
+        '--grace',
+        type=int,
+        default=15,
+        help='Seconds the nodes get to stop after the client is done'
+    )
+    args = parser.parse_args()
+
+    launcher = Launcher(args.config, args.exp_name, grace=args.grace)
+    code = None
+    try:
+        launcher.start()
+        code = launcher.wait()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        logging.error(str(e))
+    finally:
+        launcher.stop()
+    sys.exit(0 if code == 0 else 1)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import socket
+import time
+
+from .message import FRAME_HEADER, encode, decode
+from .transport import Transport
+
+
+class AsyncioRuntime(Transport):
+    def __init__(self, host='127.0.0.1'):
+        """Event loop based clock and transport for a node or the client.
+
+        Processes run as tasks sleeping with asyncio.sleep, call_later uses
+        the loop timers, the listener is an asyncio server and every peer gets
+        one persistent connection written by its own task, so all messages of
+        the component are handled on one thread. Uses the same binary frames
+        as TcpTransport. Connections are opened by send, which blocks the
+        loop for the connect only, so that it reports whether the peer is up.
+
+            host: address all ports are bound on
+        """
+        self.host = host
+        self.loop = asyncio.new_event_loop()
+        self.queues = {}
+        # Ports whose last connect or write failed
+        self.down = set()
+        # Ports with a connection of their writer task, and the sockets
+        # connected by send the writer task did not take over yet
+        self.connected = set()
+        self.sockets = {}
+        self.servers = []
+
+    def now(self):
+        """Current time in seconds"""
+        return time.time()
+
+    def call_later(self, delay, fn, *args):
+        """Call fn(*args) on the loop after delay seconds"""
+        return self.loop.call_later(delay, fn, *args)
+
+    def run(self, process):
+        """Start a process as a task, returns the task.
+
+        Args
+        ----
+            process (generator): yields sleep durations in seconds, a wakeup
+                or (wakeup, timeout)
+        """
+        return self.loop.create_task(self._run(process))
+
+    async def _run(self, process):
+        for delay in process:
+            if isinstance(delay, asyncio.Event):
+                await delay.wait()
+                delay.clear()
+            elif isinstance(delay, tuple):
+                try:
+                    await asyncio.wait_for(delay[0].wait(), delay[1])
+                except asyncio.TimeoutError:
+                    pass
+                delay[0].clear()
+            else:
+                await asyncio.sleep(delay)
+
+    def wakeup(self):
+        """Event a process can yield to sleep until it is set"""
+        return asyncio.Event()
+
+    def listen(self, port, handler, ready=None):
+        """Serve port on the loop (non-blocking)"""
+        self.loop.create_task(self._serve(port, handler, ready))
+
+    async def _serve(self, port, handler, ready):
+        try:
+            server = await asyncio.start_server(
+                lambda reader, writer: self._read(reader, writer, handler),
+                self.host, port
+            )
+            self.servers.append(server)
+        except OSError as e:
+            logging.error(str(e))
+            return
+        if ready is not None:
+            ready()
+
+    async def _read(self, reader, writer, handler):
+        """Read messages from one peer until it disconnects"""
+        try:
+            while True:
+                data = await reader.readexactly(FRAME_HEADER.size)
+                length = FRAME_HEADER.unpack_from(data)[0]
+                if length:
+                    data += await reader.readexactly(length)
+                handler(decode(data)[0])
+        except asyncio.IncompleteReadError:
+            # The peer closed the connection
+            pass
+        except (OSError, asyncio.CancelledError):
+            # Peer reset or runtime shutting down
+            pass
+        writer.close()
+
+    def send(self, message, port):
+        """Queue message for the writer task of port, returns False if port
+        could not be connected to or the last write to it failed"""
+        if not self._connect(port, [message]):
+            return False
+        self._queue(port, [message], encode(message))
+        return port not in self.down
+
+    def multicast(self, messages, ports):
+        """Encode messages once and queue them for the writer task of each port"""
+        data = b''.join(encode(message) for message in messages)
+        for port in ports:
+            if self._connect(port, messages):
+                self._queue(port, messages, data)
+
+    def _connect(self, port, messages):
+        """Connect to port unless its writer task has a connection, returns
+        False if the peer is down (and messages are dropped)"""
+        if port in self.connected:
+            return True
+        try:
+            connection = socket.create_connection((self.host, port))
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            self.down.add(port)
+            logging.error("Unable to send message %s to port %s",
+                          ' '.join(str(message) for message in messages), port)
+            return False
+        self.sockets[port] = connection
+        self.connected.add(port)
+        self.down.discard(port)
+        return True
+
+    def _queue(self, port, messages, data):
+        if port not in self.queues:
+            self.queues[port] = asyncio.Queue()
+            self.loop.create_task(self._write(port, self.queues[port]))
+        self.queues[port].put_nowait((messages, data))
+
+    async def _write(self, port, messages):
+        """Write queued messages to one peer over a persistent connection"""
+        writer = None
+        while True:
+            sent, data = await messages.get()
+            # Coalesce everything queued for this peer into one write
+            while not messages.empty():
+                more, more_data = messages.get_nowait()
+                sent = sent + more
+                data += more_data
+            # Retry once on a fresh connection if the peer dropped the old one
+            for _ in range(2):
+                try:
+                    if writer is None:
+                        connection = self.sockets.pop(port, None)
+                        if connection is not None:
+                            _, writer = await asyncio.open_connection(sock=connection)
+                        else:
+                            _, writer = await asyncio.open_connection(self.host, port)
+                    writer.write(data)
+                    await writer.drain()
+                    self.down.discard(port)
+                    break
+                except OSError:
+                    if writer is not None:
+                        writer.close()
+                    writer = None
+            else:
+                # The next send connects again
+                self.down.add(port)
+                self.connected.discard(port)
+                logging.error("Unable to send message %s to port %s",
+                              ' '.join(str(message) for message in sent), port)
+
+    def serve_forever(self):
+        """Run the event loop until close()"""
+        self.loop.run_forever()
+
+    def run_until_complete(self, task):
+        """Run the event loop until task is done"""
+        return self.loop.run_until_complete(task)
+
+    def shutdown(self):
+        """Cancel the remaining tasks (listeners, writers) and close the loop"""
+        for server in self.servers:
+            server.close()
+        for connection in self.sockets.values():
+            connection.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def close(self):
+        """Stop the event loop, serve_forever returns"""
+        self.loop.stop()
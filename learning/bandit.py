@@ -0,0 +1,155 @@
+import heapq
+import numpy as np
+
+
+class TopKIndex():
+    def __init__(self, scores):
+        """Index of the arms with the lowest scores.
+
+        Keeps a min-heap of (score, arm) entries. Updating an arm pushes a new
+        entry and invalidates the old one, so an update costs O(log N) and
+        smallest(k) O(k log N) instead of sorting all scores. NaN scores are
+        ranked last.
+
+            scores: initial score of every arm
+        """
+        self.rebuild(scores)
+
+    def rebuild(self, scores):
+        """Replace the scores of all arms, O(N)"""
+        self.scores = np.where(np.isnan(scores), np.inf, scores).astype(float)
+        self.version = np.zeros(len(self.scores), dtype=int)
+        self.heap = [(score, arm, 0) for arm, score in enumerate(self.scores.tolist())]
+        heapq.heapify(self.heap)
+
+    def update(self, arm, score):
+        """Set the score of one arm"""
+        score = np.inf if np.isnan(score) else float(score)
+        self.scores[arm] = score
+        self.version[arm] += 1
+        heapq.heappush(self.heap, (score, arm, self.version[arm]))
+        # Drop the invalidated entries once they dominate the heap
+        if len(self.heap) > 4*len(self.scores):
+            self.rebuild(self.scores)
+
+    def smallest(self, k):
+        """Arms with the k lowest scores, lowest first"""
+        found = []
+        while len(found) < k and self.heap:
+            entry = heapq.heappop(self.heap)
+            if entry[2] == self.version[entry[1]]:
+                found.append(entry)
+        for entry in found:
+            heapq.heappush(self.heap, entry)
+        return np.array([arm for _, arm, _ in found], dtype=int)
+
+
+class BetaPosterior():
+    def __init__(self, n, prior=(1, 1)):
+        """Beta-Bernoulli posteriors of the failure probability of n arms.
+
+        Every observed failure of an arm adds one to its alpha, every
+        observed success to its beta.
+
+            n: number of arms
+            prior: (alpha, beta) of the prior of every arm
+        """
+        self.alpha = np.full(n, float(prior[0]))
+        self.beta = np.full(n, float(prior[1]))
+
+    def update(self, arm, failed):
+        if failed:
+            self.alpha[arm] += 1
+        else:
+            self.beta[arm] += 1
+
+    def sample(self, rng):
+        """One failure probability per arm, drawn from the posteriors at once"""
+        return rng.beta(self.alpha, self.beta)
+
+    def mean(self):
+        return self.alpha/(self.alpha + self.beta)
+
+
+class DiscountedMean():
+    def __init__(self, estimates, gamma=0.99):
+        """Discounted mean of the observations of every arm.
+
+        Every observation discounts all earlier ones (of all arms) by gamma,
+        so old observations fade out and the estimates follow a drifting
+        failure probability. The discount of an arm is applied lazily when it
+        is observed, so an update is O(1). The initial estimate counts as one
+        observation.
+
+            estimates: initial estimate of every arm
+            gamma: discount factor per observation
+        """
+        self.gamma = gamma
+        self.memory = 1/(1 - gamma)
+        self.sums = np.array(estimates, dtype=float)
+        self.weights = np.ones(len(self.sums))
+        self.observed = np.zeros(len(self.sums))
+        self.last = np.zeros(len(self.sums))
+        self.t = 0
+        self.total = 0
+
+    def update(self, arm, value):
+        """Add an observation (1: failed, 0: alive), returns the new estimate"""
+        self.t += 1
+        decay = self.gamma ** (self.t - self.last[arm])
+        self.sums[arm] = self.sums[arm]*decay + value
+        self.weights[arm] = self.weights[arm]*decay + 1
+        self.observed[arm] = self.observed[arm]*decay + 1
+        self.last[arm] = self.t
+        self.total = self.total*self.gamma + 1
+        return self.sums[arm]/self.weights[arm]
+
+    def counts(self, ids=slice(None)):
+        """Discounted number of observations of arms ids"""
+        return self.observed[ids]*self.gamma ** (self.t - self.last[ids])
+
+    def horizon(self):
+        """Discounted number of observations of all arms"""
+        return self.total
+
+
+class WindowMean():
+    def __init__(self, estimates, window=100):
+        """Mean of the last window observations of every arm.
+
+        Observations are kept in a ring buffer per arm with a running sum,
+        so an update is O(1). An arm keeps its initial estimate until it is
+        observed.
+
+            estimates: initial estimate of every arm
+            window: number of observations kept per arm
+        """
+        self.memory = window
+        self.estimates = np.array(estimates, dtype=float)
+        self.buffer = np.zeros((len(self.estimates), window))
+        self.position = np.zeros(len(self.estimates), dtype=int)
+        self.filled = np.zeros(len(self.estimates))
+        self.sums = np.zeros(len(self.estimates))
+        self.total = 0
+
+    def update(self, arm, value):
+        """Add an observation (1: failed, 0: alive), returns the new estimate"""
+        position = self.position[arm]
+        if self.filled[arm] == self.memory:
+            self.sums[arm] -= self.buffer[arm, position]
+        else:
+            self.filled[arm] += 1
+            self.total += 1
+        self.buffer[arm, position] = value
+        self.sums[arm] += value
+        self.position[arm] = (position + 1) % self.memory
+        self.estimates[arm] = self.sums[arm]/self.filled[arm]
+        return self.estimates[arm]
+
+    def counts(self, ids=slice(None)):
+        """Number of observations of arms ids in the window"""
+        return self.filled[ids]
+
+    def horizon(self):
+        """Number of observations of all arms in the windows"""
+        return self.total
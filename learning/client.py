@@ -1,39 +1,106 @@
 import logging
-import time
 from os.path import join
 
 from .node import Node
+from .window import RequestWindow
 from learning.message import *
-from utils.logger import ViewChangeLogger, LeaderLogger, make_dirs
-from _thread import *
-import socket
+from utils.logger import ViewChangeLogger, LeaderLogger, make_dirs, stream_kwargs, setup_logging
 import threading
 
-lock = threading.Lock()
+
+class RttEstimator():
+    def __init__(self, initial, min_timeout):
+        """Timeout from the smoothed round trip time and its variation
+        (SRTT/RTTVAR as in TCP). It starts at initial and never exceeds it.
+
+            initial: timeout before the first sample
+            min_timeout: lower bound of the timeout
+        """
+        self.srtt = None
+        self.rttvar = None
+        self.initial = initial
+        self.min_timeout = min_timeout
+        self.timeout = initial
+
+    def sample(self, rtt):
+        """Update the timeout with a measured round trip time"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt/2
+        else:
+            self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt - rtt)
+            self.srtt = 0.875*self.srtt + 0.125*rtt
+        self.timeout = min(max(self.srtt + 4*self.rttvar, self.min_timeout), self.initial)
+
+
+class LeaderCache():
+    def __init__(self, size=4):
+        """Most recent leader hints (redirects and candidate leaders) the
+        client tries before broadcasting a request.
+
+            size: number of hints kept
+        """
+        self.size = size
+        self.hints = {}
+
+    def add(self, id, stamp):
+        """Keep the newest stamp of leader id, drops the oldest hint if full"""
+        id = int(id)
+        if stamp > self.hints.get(id, -1):
+            self.hints[id] = stamp
+        if len(self.hints) > self.size:
+            del self.hints[min(self.hints, key=self.hints.get)]
+
+    def next(self, tried, since):
+        """Newest hint newer than since and not in tried as a leader dict,
+        None if there is none"""
+        hints = [(stamp, id) for id, stamp in self.hints.items() if stamp > since and id not in tried]
+        if not hints:
+            return None
+        stamp, id = max(hints)
+        return {'id': id, 'stamp': stamp}
+
 
 class Client(Node):
-    def __init__(self, id, n, config, exp_name):
+    def __init__(self, id, n, config, exp_name, clock=None, transport=None):
         """Initialize client node
 
             id: Node id (-1 for client)
             n: total number of nodes
             config: config parameters
+            clock: time source (default: WallClock)
+            transport: message transport (default: TcpTransport)
         """
-        super().__init__(id, n, config, exp_name)
+        super().__init__(id, n, config, exp_name, clock, transport)
 
+        self.lock = threading.Lock()
         self.run = True
-        self.message_buffer = {}
         self.num_leader_election = 0 # total number of times the leader election happens
         self.num_requests = config.client.num_requests
-        logging.basicConfig(level=logging.INFO,
-                            format='%(asctime)s %(levelname)-8s [Client] %(funcName)s() %(message)s',
-                            datefmt='%Y-%m-%d %H:%M:%S', handlers=[
-                                logging.FileHandler("logs/client_{}.log".format(self.exp_name)),
-                                logging.StreamHandler()
-                                ]
-        )
+        # Number of requests in flight at once (1: one request at a time)
+        self.window = config.client.get('window', 1)
+        # IDs of the requests with a response
+        self.message_buffer = RequestWindow(max(config.client.get('request_window', 1024), 2*self.window))
+        setup_logging(config, '%(asctime)s %(levelname)-8s [Client] %(funcName)s() %(message)s',
+                      "logs/client_{}.log".format(self.exp_name))
         self.candidate_leader = None
-        self.leader_logger = LeaderLogger(time.time()*100)
+        self.leader_cache = LeaderCache(config.client.get('leader_cache', 4))
+
+        # Wait for responses until woken up by the receiver or timed out
+        self.response_wakeup = self.clock.wakeup()
+        self.request_rtt = RttEstimator(
+            config.client.get('timeout', 2), config.client.get('min_timeout', 0.2))
+        # Wait at least as long as an election of the nodes may take
+        self.broadcast_rtt = RttEstimator(
+            config.client.get('broadcast_timeout', 6),
+            max(config.client.get('min_timeout', 0.2), config.node.get('election_timeout', 5)))
+        # (id, stamp) of the last leader lost, counted in num_leader_election
+        self.lost_leader = None
+
+        self.leader_logger = LeaderLogger(self.clock.now()*100,
+            **stream_kwargs(config, self.exp_name, 'leader_log'))
+        self.view_change_logger = ViewChangeLogger(self.clock.now()*100, self.total_nodes,
+            **stream_kwargs(config, self.exp_name, 'client_view_changes'))
 
 
     def receive_confirm_election_msg(self, message):
@@ -42,16 +109,30 @@ class Client(Node):
             self.leader['id'] = message.leader
             self.leader['stamp'] = message.stamp
             self.view_change_logger.tick(message.stamp, message.sender)
-            logging.info("[Leader] Changed leader to {} @ {}".format(self.leader['id'], self.leader['stamp']))
+            logging.info("[Leader] Changed leader to %s @ %s", self.leader['id'], self.leader['stamp'])
+            self.response_wakeup.set()
 
-        logging.info("[RECV][LeaderElec] ConfirmElectionMsg from: {} @ {}, msg: {}"
-                     .format(message.sender, message.stamp, message))
+        logging.info("[RECV][LeaderElec] ConfirmElectionMsg from: %s @ %s, msg: %s",
+                     message.sender, message.stamp, message)
 
     def receive_candidate_leader(self, message):
-        logging.info("[RECV][CandidateLeader] NewLeaderMsg from: {} @ {}, msg: {}"
-                     .format(message.sender, message.stamp, message))
+        logging.info("[RECV][CandidateLeader] NewLeaderMsg from: %s @ %s, msg: %s",
+                     message.sender, message.stamp, message)
         if self.candidate_leader is None:
             self.candidate_leader = message.leader
+        self.leader_cache.add(message.leader, message.stamp)
+
+    def receive_redirect_msg(self, message):
+        """A node that knows a newer leader than ours points us to it"""
+        logging.info("[RECV] RedirectMsg from: %s @ %s, msg: %s",
+                     message.sender, message.stamp, message)
+        self.leader_cache.add(message.leader, message.stamp)
+        if message.stamp > self.leader['stamp']:
+            self.leader['id'] = message.leader
+            self.leader['stamp'] = message.stamp
+            self.view_change_logger.tick(message.stamp, message.leader)
+            logging.info("[Leader] Changed leader to %s @ %s", self.leader['id'], self.leader['stamp'])
+            self.response_wakeup.set()
 
     def receive_response_msg(self, message):
         """Receive response for request."""
@@ -60,96 +141,136 @@ class Client(Node):
                 self.leader['id'] = message.sender
                 self.leader['stamp'] = message.stamp
                 self.view_change_logger.tick(message.stamp, message.sender)
-                logging.info("[Leader] Changed leader to {} @ {}".format(self.leader['id'], self.leader['stamp']))
+                logging.info("[Leader] Changed leader to %s @ %s", self.leader['id'], self.leader['stamp'])
 
         requestId = message.requestId
-        self.message_buffer[requestId] = 1
-        logging.info("[RECV] ResponseMsg from: {} @ {}, Msg: {}".format(message.sender, message.stamp, message))
+        self.message_buffer.add(requestId)
+        self.response_wakeup.set()
+        logging.info("[RECV] ResponseMsg from: %s @ %s, Msg: %s", message.sender, message.stamp, message)
 
 
-    def multi_threaded_client(self, connection):
-        """Read message and perform action."""
-        while True:
-            data = str(connection.recv(2048).decode('ascii'))
+    def handle_message(self, message):
+        """Dispatch a parsed message to its handler."""
+        if isinstance(message, ConfirmElectionMessage):
+            self.receive_confirm_election_msg(message)
 
-            if not data:
-                break
+        elif isinstance(message, ResponseMessage):
+            self.receive_response_msg(message)
 
-            message = parse_and_construct(data)
+        elif isinstance(message, NewLeaderMessage):
+            self.receive_candidate_leader(message)
 
-            if isinstance(message, ConfirmElectionMessage):
-                self.receive_confirm_election_msg(message)
+        elif isinstance(message, RedirectMessage):
+            self.receive_redirect_msg(message)
 
-            elif isinstance(message, ResponseMessage):
-                self.receive_response_msg(message)
+        elif isinstance(message, type(None)):
+            logging.warning("Error parsing message, received unknown: %s", message)
 
-            elif isinstance(message, NewLeaderMessage):
-                self.receive_candidate_leader(message)
+        else:
+            logging.warning("[RECV] Unexpected message from: %s @ %s, Msg: %s", message.sender, message.stamp, message)
 
-            elif isinstance(message, type(None)):
-                logging.warning("Error parsing message, received unknown: {}".format(message))
 
-            else:
-                logging.warning("[RECV] Unexpected message from: {} @ {}, Msg: {}".format(message.sender, message.stamp, message))
+    def receive_messages(self):
+        """Receive message thread"""
+        self.transport.listen(self.client_port, self.receive, self.on_listening)
 
-        connection.close()
 
+    def send_request(self, request_id, leader=None):
+        """Send client requests to leader (default: our leader), a dict with
+        its id and stamp"""
+        leader = self.leader if leader is None else leader
+        message = ClientRequestMessage(-1, leader['id'], self.clock.now()*100, request_id, leader['stamp'])
+        port = self.ports[leader['id']]
+        logging.info("[SEND] ClientRequestMsg ID: %s Dest (Leader): %s", request_id, leader['id'])
+        self.send_unicast(message, port)
 
-    def receive_messages(self):
-        """Receive message thread"""
-        host = '127.0.0.1'
-        port = self.client_port
-        self.view_change_logger = ViewChangeLogger(time.time()*100, self.total_nodes)
-        receiving_socket = socket.socket()
-        try:
-            receiving_socket.bind((host, port))
-        except socket.error as e:
-            logging.error(str(e))
-        receiving_socket.listen(5)
-        #receiving_socket.settimeout(30)
-        while self.run:
-            Client, address = receiving_socket.accept()
-            start_new_thread(self.multi_threaded_client, (Client,))
-
-
-    def send_request(self, request_id):
-        """Send client requests"""
-        message = str(ClientRequestMessage(-1, self.leader['id'], time.time()*100, request_id))
-        port = self.ports[self.leader['id']]
-        host = '127.0.0.1'
-        logging.info("[SEND] ClientRequestMsg ID: {} Dest (Leader): {}".format(request_id, self.leader['id']))
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            s.connect((host, port))
-            s.send(message.encode('ascii'))
-            s.close()
-        except Exception as msg:
-            logging.error(str(msg))
-            s.close()
+
+    def send_hinted_request(self, request_id, tried):
+        """Send the request to the newest hinted leader not in tried,
+        returns False if there is none"""
+        hint = self.leader_cache.next(tried, self.leader['stamp'])
+        if hint is None:
+            return False
+        tried.add(hint['id'])
+        logging.info("[Status] Trying hinted leader %s for ID: %s", hint['id'], request_id)
+        self.send_request(request_id, hint)
+        return True
+
+
+    def count_election(self):
+        """Count the election replacing our leader, once however many times
+        its requests are broadcast"""
+        lost = (int(self.leader['id']), self.leader['stamp'])
+        if lost != self.lost_leader:
+            self.lost_leader = lost
+            self.num_leader_election += 1
 
 
     def send_request_broadcast(self, request_id):
         """If leader is not responding, broadcast request"""
-        message = str(ClientRequestMessage(-1, self.leader['id'], time.time()*100, request_id))
-        host = '127.0.0.1'
-        logging.info("[SEND] RequestBroadcastMsg ID: {}".format(request_id))
+        message = ClientRequestMessage(-1, self.leader['id'], self.clock.now()*100, request_id,
+                                       self.leader['stamp'])
+        logging.info("[SEND] RequestBroadcastMsg ID: %s", request_id)
         for port in self.ports:
             if port != self.ports[self.leader['id']]:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                try:
-                    s.connect((host, port))
-                    s.send(message.encode('ascii'))
-                    s.close()
-                except Exception as msg:
-                    logging.error(str(msg))
-                    s.close()
+                self.send_unicast(message, port)
 
 
     def run_node(self):
         """Run send, receive threads"""
-        logging.info("[Status] Starting Client: {}".format(self.client_port))
-        receive = threading.Thread(target=self.receive_messages)
+        logging.info("[Status] Starting Client: %s", self.client_port)
+        # The listener must not keep the client alive once all requests are done
+        receive = threading.Thread(target=self.receive_messages, daemon=True)
         receive.start()
+        self.clock.run(self.request_process())
+
+
+    def start(self):
+        """Start listening and sending requests on an event-driven clock
+        (simulator, asyncio) without blocking, returns the request process
+        handle of the clock."""
+        logging.info("[Status] Starting Client: %s", self.client_port)
+        self.receive_messages()
+        return self.clock.run(self.request_process())
+
+
+    def wait_until(self, done, timeout):
+        """Sleep until done() or timeout seconds passed, woken up by the
+        receiver, yields the wakeup with the remaining time."""
+        deadline = self.clock.now() + timeout
+        while not done() and self.clock.now() < deadline:
+            yield (self.response_wakeup, deadline - self.clock.now())
+
+
+    def request_process(self):
+        """Send all requests, one at a time or client.window at once, and
+        save the logs, yields the time to sleep."""
+        if self.window > 1:
+            yield from self.pipelined_requests()
+        else:
+            yield from self.serial_requests()
+
+        make_dirs(join(self.exp_name))
+        self.view_change_logger.save(join(self.exp_name, 'client_view_changes.pbz2'))
+        self.leader_logger.save(join(self.exp_name, 'leader_log.pbz2'))
+        if self.trace is not None:
+            self.trace.close()
+        self.lock.acquire()
+        self.run = False
+        self.lock.release()
+        print("Total Requests : {}, Number of Leader Elections : {}", self.num_requests, self.num_leader_election)
+        logging.info("Total Requests : %s, Number of Leader Elections : %s", self.num_requests, self.num_leader_election)
+
+
+    def serial_requests(self):
+        """Send requests one at a time and fall back to broadcast if the
+        leader does not respond in time, yields the time to sleep.
+
+        Both timeouts follow the measured round trip times: the one of a
+        request to the leader, and the one of a broadcast to the response or
+        the new leader. Before broadcasting, the request is sent to the
+        leaders hinted by redirects and candidate leaders.
+        """
         i = 0
         prev_request = -1
         while i < self.num_requests:
@@ -157,40 +278,149 @@ class Client(Node):
             current_leader = self.leader['id']
             # is_broadcast : Did the client broadcast the request?
             is_broadcast = False
-            if prev_request != i:
+            # Only time requests sent once (the response could be to an
+            # earlier send otherwise)
+            is_first_send = prev_request != i
+            if is_first_send:
+                # tried : Leaders request i was sent to
+                tried = {int(current_leader)}
                 self.send_request(i)
             prev_request = i
-            time.sleep(2)
-            if i in self.message_buffer.keys():
-                logging.info("[Status] Verified received ResponseMsg ID: {}".format(i))
-                del self.message_buffer[i]
+            sent = self.clock.now()
+            yield from self.wait_until(
+                lambda: i in self.message_buffer or int(current_leader) != int(self.leader['id']),
+                self.request_rtt.timeout
+            )
+            if i in self.message_buffer:
+                if is_first_send:
+                    self.request_rtt.sample(self.clock.now() - sent)
+                logging.info("[Status] Verified received ResponseMsg ID: %s", i)
                 i += 1  # next request id
+            elif int(current_leader) != int(self.leader['id']):
+                # Redirected to (or confirmed) a new leader, send it there
+                logging.info("[Status] Leader changed, sending ID: %s again", i)
+                tried.add(int(self.leader['id']))
+                self.send_request(i)
             else:
+                logging.info("[Status] Not received ResponseMsg ID: %s", i)
+                if self.send_hinted_request(i, tried):
+                    continue
                 self.candidate_leader = None
-                logging.info("[Status] Not received ResponseMsg ID: {}".format(i))
                 self.send_request_broadcast(i)
-                self.num_leader_election += 1 # Every time a client sends a broadcast, it means the leader failed and election will happen
+                self.count_election()
                 is_broadcast = True
-                time.sleep(6)
+                sent = self.clock.now()
+                yield from self.wait_until(
+                    lambda: i in self.message_buffer or int(current_leader) != int(self.leader['id']),
+                    self.broadcast_rtt.timeout
+                )
+                if i in self.message_buffer or int(current_leader) != int(self.leader['id']):
+                    self.broadcast_rtt.sample(self.clock.now() - sent)
             if is_broadcast:
                 # If the client broadcasted the request and the leader still didn't change, it will re-send the same request
                 if int(current_leader) != int(self.leader['id']):
                     logging.info("[Status] New Leader elected, next request ID...")
                     i += 1
                     # log self.local_leader and set it to None with status as not failed
-                    self.leader_logger.tick(time.time()*100, self.candidate_leader, 0)
+                    self.leader_logger.tick(self.clock.now()*100, self.candidate_leader, 0)
                     self.candidate_leader = None
                 else:
                     # log self.local_leader and set it to None with status as failed
-                    self.leader_logger.tick(time.time()*100, self.candidate_leader, 1)
+                    self.leader_logger.tick(self.clock.now()*100, self.candidate_leader, 1)
                     self.candidate_leader = None
 
 
-        make_dirs(join(self.exp_name))
-        self.view_change_logger.save(join(self.exp_name, 'client_view_changes.pbz2'))
-        self.leader_logger.save(join(self.exp_name, 'leader_log.pbz2'))
-        lock.acquire()
-        self.run = False
-        lock.release()
-        print("Total Requests : {}, Number of Leader Elections : {}", self.num_requests, self.num_leader_election)
-        logging.info("Total Requests : {}, Number of Leader Elections : {}".format(self.num_requests, self.num_leader_election))
+    def pipelined_requests(self):
+        """Keep up to client.window requests in flight, yields the time to
+        sleep.
+
+        Responses are matched to requests by ID in message_buffer. The first
+        request that times out is broadcast, the ones timing out after it
+        wait for that broadcast, so a lost leader counts as one election.
+        Once a new leader is known, or the broadcast is answered or times
+        out, the waiting requests are sent again to the leader. Before
+        broadcasting, a request is sent to the leaders hinted by redirects
+        and candidate leaders.
+        """
+        next_request = 0
+        completed = 0
+        # request ID -> sent, deadline, first_send (bool), leaders tried (set)
+        in_flight = {}
+        # [request ID, sent, deadline] of the outstanding broadcast
+        broadcast = None
+        leader = self.leader['id']
+        while completed < self.num_requests:
+            # Fill the window
+            while next_request < self.num_requests and len(in_flight) < self.window:
+                self.send_request(next_request)
+                now = self.clock.now()
+                in_flight[next_request] = [now, now + self.request_rtt.timeout, True, {int(leader)}]
+                next_request += 1
+
+            deadline = min(request[1] for request in in_flight.values())
+            yield from self.wait_until(
+                lambda: self.leader['id'] != leader or any(i in self.message_buffer for i in in_flight),
+                deadline - self.clock.now()
+            )
+            now = self.clock.now()
+
+            # Responses
+            for i in [i for i in in_flight if i in self.message_buffer]:
+                sent, _, first_send, _ = in_flight.pop(i)
+                if broadcast is not None and broadcast[0] == i:
+                    self.broadcast_rtt.sample(now - broadcast[1])
+                    self.leader_logger.tick(now*100, self.candidate_leader, 0)
+                    self.candidate_leader = None
+                    # The leader answered, send it the requests waiting for
+                    # the broadcast
+                    for j, request in in_flight.items():
+                        if request[1] == broadcast[2]:
+                            self.send_request(j)
+                            in_flight[j] = [now, now + self.request_rtt.timeout, False, request[3]]
+                    broadcast = None
+                elif first_send:
+                    self.request_rtt.sample(now - sent)
+                logging.info("[Status] Verified received ResponseMsg ID: %s", i)
+                completed += 1
+
+            # New leader: send everything still in flight to it
+            if self.leader['id'] != leader:
+                leader = self.leader['id']
+                logging.info("[Status] New Leader elected, sending %s requests again", len(in_flight))
+                if broadcast is not None:
+                    self.broadcast_rtt.sample(now - broadcast[1])
+                    self.leader_logger.tick(now*100, self.candidate_leader, 0)
+                    broadcast = None
+                for i, request in in_flight.items():
+                    self.send_request(i)
+                    request[3].add(int(leader))
+                    in_flight[i] = [now, now + self.request_rtt.timeout, False, request[3]]
+                self.candidate_leader = None
+
+            if broadcast is not None and broadcast[2] <= now:
+                # The broadcast did not elect a new leader, send the waiting
+                # requests to the leader again
+                self.leader_logger.tick(now*100, self.candidate_leader, 1)
+                self.candidate_leader = None
+                broadcast = None
+                for i, request in in_flight.items():
+                    if request[1] <= now:
+                        self.send_request(i)
+                        in_flight[i] = [now, now + self.request_rtt.timeout, False, request[3]]
+
+            # Timeouts
+            for i, request in in_flight.items():
+                if request[1] > now:
+                    continue
+                if broadcast is not None:
+                    # Wait for the outstanding broadcast
+                    request[1] = broadcast[2]
+                    continue
+                logging.info("[Status] Not received ResponseMsg ID: %s", i)
+                if self.send_hinted_request(i, request[3]):
+                    in_flight[i] = [now, now + self.request_rtt.timeout, False, request[3]]
+                else:
+                    self.send_request_broadcast(i)
+                    self.count_election()
+                    broadcast = [i, now, now + self.broadcast_rtt.timeout]
+                    in_flight[i] = [now, broadcast[2], False, request[3]]
@@ -0,0 +1,51 @@
+import threading
+import time
+
+
+class WallClock():
+    def __init__(self):
+        """Real time clock used when every component runs in its own process.
+
+        Periodic loops of the nodes, client and environment are written as
+        generators (processes) that yield the number of seconds to sleep, a
+        wakeup() to sleep until it is set, or (wakeup, timeout) to sleep until
+        it is set or timeout seconds passed, so the same code can also be
+        driven by the discrete-event simulator.
+        """
+        pass
+
+    def now(self):
+        """Current time in seconds"""
+        return time.time()
+
+    def sleep(self, sec):
+        """Block the calling thread for sec seconds"""
+        time.sleep(sec)
+
+    def call_later(self, delay, fn, *args):
+        """Call fn(*args) after delay seconds in a timer thread"""
+        timer = threading.Timer(delay, fn, args)
+        timer.start()
+        return timer
+
+    def wakeup(self):
+        """Event a process can yield to sleep until it is set"""
+        return threading.Event()
+
+    def run(self, process):
+        """Run a process in the calling thread until it returns.
+
+        Args
+        ----
+            process (generator): yields sleep durations in seconds, a wakeup
+                or (wakeup, timeout)
+        """
+        for delay in process:
+            if isinstance(delay, threading.Event):
+                delay.wait()
+                delay.clear()
+            elif isinstance(delay, tuple):
+                delay[0].wait(delay[1])
+                delay[0].clear()
+            else:
+                self.sleep(delay)
@@ -0,0 +1,72 @@
+import math
+import numpy as np
+
+
+class PhiAccrualDetector():
+    def __init__(self, n, window=100, min_std=0.05):
+        """Phi accrual failure detector of n nodes.
+
+        Keeps the last window inter-arrival times of the messages heard from
+        every node. phi is the suspicion that a node failed given the time
+        since its last message: -log10 of the probability that the next
+        message arrives even later, with normally distributed inter-arrival
+        times. phi = 1 is a 10% chance of a false suspicion, phi = 8 a
+        chance of 1e-8.
+
+            n: number of nodes
+            window: number of inter-arrival times kept per node
+            min_std: lower bound of the standard deviation of the
+                inter-arrival times, so that regular messages (heartbeats)
+                do not make phi too sensitive to jitter
+        """
+        self.window = window
+        self.min_std = min_std
+        self.intervals = np.zeros((n, window))
+        self.position = np.zeros(n, dtype=int)
+        self.filled = np.zeros(n, dtype=int)
+        self.sums = np.zeros(n)
+        self.squares = np.zeros(n)
+        self.last = np.full(n, np.nan)
+
+    def heartbeat(self, id, now):
+        """A message of node id arrived at now"""
+        if not np.isnan(self.last[id]):
+            self._add(id, now - self.last[id])
+        self.last[id] = now
+
+    def reset(self, id, now, interval):
+        """Forget the history of node id, its next message is expected
+        interval seconds after now"""
+        self.filled[id] = 0
+        self.position[id] = 0
+        self.sums[id] = 0
+        self.squares[id] = 0
+        self._add(id, interval)
+        self.last[id] = now
+
+    def _add(self, id, interval):
+        position = self.position[id]
+        if self.filled[id] == self.window:
+            old = self.intervals[id, position]
+            self.sums[id] -= old
+            self.squares[id] -= old*old
+        else:
+            self.filled[id] += 1
+        self.intervals[id, position] = interval
+        self.sums[id] += interval
+        self.squares[id] += interval*interval
+        self.position[id] = (position + 1) % self.window
+
+    def phi(self, id, now):
+        """Suspicion level of node id at now, 0 if it was never heard from"""
+        if self.filled[id] == 0:
+            return 0.0
+        mean = self.sums[id]/self.filled[id]
+        std = math.sqrt(max(self.squares[id]/self.filled[id] - mean*mean, 0))
+        std = max(std, self.min_std)
+        later = 0.5*math.erfc((now - self.last[id] - mean)/(std*math.sqrt(2)))
+        return -math.log10(later) if later > 0 else math.inf
+
+    def known(self, id):
+        """Whether there are inter-arrival times of node id"""
+        return self.filled[id] > 0
@@ -0,0 +1,62 @@
+import numpy as np
+
+
+class VoteTally():
+    def __init__(self, n, replaced):
+        """Votes of the elections for the node replacing leader replaced.
+
+        Every voter proposes a list of candidates, each one vote. Votes are
+        counted as they arrive, a voter voting again replaces its earlier
+        candidates. A decided election closes the round, votes arriving
+        later still count until the next round drops the ballots of the
+        decided one.
+
+            n: number of nodes
+            replaced: id of the leader being replaced, it cannot win
+        """
+        self.replaced = int(replaced)
+        self.votes = np.zeros(n, dtype=int)
+        self.ballots = {}
+        self.rounds = {}
+        self.round = 0
+        self.winner = None
+
+    def vote(self, voter, candidates):
+        """Count the candidates of voter"""
+        candidates = np.asarray(candidates, dtype=int)
+        candidates = candidates[(candidates >= 0) & (candidates < len(self.votes))]
+        if voter in self.ballots:
+            np.subtract.at(self.votes, self.ballots[voter], 1)
+        np.add.at(self.votes, candidates, 1)
+        self.ballots[voter] = candidates
+        self.rounds[voter] = self.round
+
+    def voters(self):
+        return len(self.ballots)
+
+    def leading(self):
+        """Node with the most votes, the lowest id on ties"""
+        votes = self.votes.copy()
+        votes[self.replaced] = -1
+        return int(np.argmax(votes))
+
+    def decide(self, quorum):
+        """New winner once quorum voters voted, None if there are fewer
+        voters or the leading node already won"""
+        if self.voters() < quorum or self.leading() == self.winner:
+            return None
+        self.winner = self.leading()
+        self.round += 1
+        return self.winner
+
+    def new_round(self):
+        """Start another election, the winner of the last one did not take
+        over. Drops the ballots cast up to its decision, an undecided
+        election goes on"""
+        if self.winner is None:
+            return
+        for voter, round in list(self.rounds.items()):
+            if round < self.round:
+                np.subtract.at(self.votes, self.ballots.pop(voter), 1)
+                del self.rounds[voter]
+        self.winner = None
@@ -1,21 +1,67 @@
+import math
 import numpy as np
 import time
 import threading
-from sklearn.model_selection import train_test_split
 import logging
-import socket
 from .message import *
-
-lock = threading.Lock()
+from .clock import WallClock
+from .transport import TcpTransport
+from utils.logger import TRACE_EVENTS, TRACE_SEND, event_trace, setup_logging
+
+def sample_failures(rng, failure_probability, alive, min_failed, max_failed):
+    """Sample the alive nodes to fail in one round.
+
+    Every alive node fails with its failure probability in one vectorized
+    draw. If fewer than min_failed nodes are then down, the missing ones are
+    drawn without replacement from the other alive nodes, weighted by their
+    failure probability, and if more than max_failed are down only a random
+    subset of the new failures is kept. Nothing fails when at least
+    min_failed nodes are already down.
+
+        rng: numpy random Generator
+        failure_probability: failure probability of each node
+        alive: boolean mask of the alive nodes
+        min_failed: minimum number of nodes down after the round
+        max_failed: maximum number of nodes down after the round
+
+    Returns the sorted indices of the nodes to fail
+    """
+    down = len(alive) - np.count_nonzero(alive)
+    if down >= min_failed:
+        return np.array([], dtype=np.int64)
+
+    failed = alive & (rng.random(len(alive)) < failure_probability)
+    indices = np.flatnonzero(failed)
+
+    # Top up to min_failed, nodes that never fail (p = 0) are taken last
+    missing = math.ceil(min_failed) - down - len(indices)
+    if missing > 0:
+        candidates = np.flatnonzero(alive & ~failed)
+        weights = failure_probability[candidates]
+        likely, never = candidates[weights > 0], candidates[weights <= 0]
+        k = min(missing, len(likely))
+        if k > 0:
+            weights = weights[weights > 0]
+            indices = np.concatenate([indices, rng.choice(likely, k, replace=False, p=weights/np.sum(weights))])
+        k = min(missing - k, len(never))
+        if k > 0:
+            indices = np.concatenate([indices, rng.choice(never, k, replace=False)])
+
+    # Random sample to limit nodes failed to max_failed
+    if down + len(indices) > max_failed:
+        indices = rng.choice(indices, max(max_failed - down, 0), replace=False)
+    return np.sort(indices)
 
 class Environment:
-    def __init__(self, n, config, exp_name=None):
+    def __init__(self, n, config, exp_name=None, clock=None, transport=None):
         """Initialize environment
 
             n: total number of nodes
             fail_nodes_update: Sleep time between updating failure probability
             nodes: List of node objects
             config: config parameters
+            clock: time source (default: WallClock)
+            transport: message transport (default: TcpTransport)
         """
         self.total_nodes = n
         self.exp_name = "{}_{}".format(self.total_nodes, config.mab.algo) \
@@ -30,17 +76,19 @@ class Environment:
         self.min_fail_fraction = config.min_fail_fraction
         self.replica_base_port = config.port.replica_base_port
         self.config = config
+        self.clock = WallClock() if clock is None else clock
+        self.transport = TcpTransport() if transport is None else transport
 
         self.run = False
+        # Guards the machine status, which repair timers update concurrently
+        self.lock = threading.Lock()
         self.ports = [int(self.replica_base_port) + i for i in range(n)]
 
-        logging.basicConfig(level=logging.INFO,
-            format='[%(asctime)s %(levelname)-8s [ENV] %(funcName)s() %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S', handlers=[
-                logging.FileHandler("logs/env_{}.log".format(self.exp_name)),
-                logging.StreamHandler()
-                ]
-        )
+        setup_logging(config, '[%(asctime)s %(levelname)-8s [ENV] %(funcName)s() %(message)s',
+                      "logs/env_{}.log".format(self.exp_name))
+        # Binary trace of the messages sent (log.trace), node -2
+        self.trace = event_trace(config, self.exp_name, 'env',
+                                 {'events': TRACE_EVENTS, 'messages': [cls.__name__ for cls in MESSAGE_TYPES]})
 
 
     def set_probability(self):
@@ -57,6 +105,15 @@ class Environment:
             ))
 
 
+    def send_unicast(self, message, port):
+        """Send point-to-point message, returns False if it could not be sent"""
+        sent = self.transport.send(message, port)
+        if sent and self.trace is not None:
+            self.trace.record(self.clock.now(), -2, TRACE_SEND, MESSAGE_TAGS[type(message)],
+                              port - int(self.replica_base_port))
+        return sent
+
+
     def fail_nodes(self):
         """Fail up to f nodes"""
         while self.run:
@@ -76,27 +133,20 @@ class Environment:
 
             # send the failure values to the respective nodes
             logging.info("failed nodes {}".format(indices))
-            host = '127.0.0.1'
             for port in self.ports:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                try:
-                    if port - self.replica_base_port in indices:
-                        failVal = "True"
-                    else:
-                        failVal = "False"
-                    message = str(FailureMessage(-2, 0, time.time()*100, failVal))
-                    s.connect((host, port))
-                    s.send(message.encode('ascii'))
-                    s.close()
-                except Exception as msg:
-                    logging.error(str(msg) + " while connecting to {}".format(port))
-                    s.close()
+                if port - self.replica_base_port in indices:
+                    failVal = "True"
+                else:
+                    failVal = "False"
+                self.send_unicast(FailureMessage(-2, 0, self.clock.now()*100, failVal), port)
             time.sleep(self.fail_nodes_update)
 
 
     def update_probability(self):
         """Update failure probability in case of non-stationary failure prob"""
         if not self.stationary:
+            # sklearn takes seconds to import, only load it when needed
+            from sklearn.model_selection import train_test_split
             while self.run:
                 # Sample nodes to increase and decrease
                 increase, decrease = train_test_split(
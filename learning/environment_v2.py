@@ -1,28 +1,24 @@
 import numpy as np
 from os.path import join
-import time
-from _thread import *
-import threading
 from numpy.random import default_rng
 import logging
-import socket
 from .message import *
-from utils.logger import FailureLogger, make_dirs
-from .environment import Environment
+from utils.logger import FailureLogger, make_dirs, stream_kwargs
+from .environment import Environment, sample_failures
 
 
-lock = threading.Lock()
-
 class Environmentv2(Environment):
-    def __init__(self, n, config, exp_name):
+    def __init__(self, n, config, exp_name, clock=None, transport=None):
         """Initialize environment
 
             n: total number of nodes
             fail_nodes_update: Sleep time between updating failure probability
             nodes: List of node objects
             config: config parameters
+            clock: time source (default: WallClock)
+            transport: message transport (default: TcpTransport)
         """
-        super().__init__(n, config, exp_name)
+        super().__init__(n, config, exp_name, clock, transport)
         self.seed = config.random_seed
 
         self.rng = default_rng(self.seed)
@@ -43,19 +39,20 @@ class Environmentv2(Environment):
         self.set_probability()
 
     def sleep_for_repair(self, node_id):
-        try:
-            repair_duration = self.rng.lognormal(self.repair_time_mean, self.repair_time_sigma) # sample from repair_distribution
-            repair_duration *= self.repair_scale_factor
-            repair_duration = min(repair_duration, 30)
-            repair_duration = max(repair_duration, 7)
-            logging.info("[Status] Node {} for {} secs.".format(node_id, repair_duration))
-            time.sleep(repair_duration)
-            lock.acquire()
-            self.machine_status[node_id] = 1
-            lock.release()
-        except KeyboardInterrupt:
-            print('Evironment is shutting down!')
-            self.logger.save('env_fails_{}_{}'.format(self.total_nodes, self.config.mab.algo))
+        """Schedule the repair of a failed node after a sampled repair time"""
+        repair_duration = self.rng.lognormal(self.repair_time_mean, self.repair_time_sigma) # sample from repair_distribution
+        repair_duration *= self.repair_scale_factor
+        repair_duration = min(repair_duration, 30)
+        repair_duration = max(repair_duration, 7)
+        logging.info("[Status] Node {} for {} secs.".format(node_id, repair_duration))
+        self.clock.call_later(repair_duration, self.repair_node, node_id)
+
+
+    def repair_node(self, node_id):
+        """Mark node as alive after its repair period"""
+        self.lock.acquire()
+        self.machine_status[node_id] = 1
+        self.lock.release()
 
 
     def set_probability(self):
@@ -72,59 +69,58 @@ class Environmentv2(Environment):
 
     def fail_nodes(self):
         """Fail up to f nodes"""
-        self.logger = FailureLogger(time.time()*100, self.total_nodes, self.failure_probability)
         try:
-            while self.run:
-                # Sample from binomial dist. (p = node failure prob.)
-                alive_nodes = np.where(self.machine_status == 1) # returns indices of all alive nodes
-                indices = []
-
-                # we should fail atleast some nodes
-                while len(indices) + (self.total_nodes - np.sum(self.machine_status)) < self.min_fail_fraction*self.max_failed_nodes:
-
-                    # Decide to fail or not
-                    for idx, val in enumerate(self.failure_probability):
-                        # select a new node (hasn't been selected before) which is alive
-                        if idx not in indices and self.machine_status[idx] == 1 and self.rng.binomial(1, val) == 1:
-                            indices.append(idx)
-
-                # Random sample to limit nodes failed to self.max_failed_nodes
-                if len(indices) + (self.total_nodes - np.sum(self.machine_status)) > self.max_failed_nodes:
-                    indices = self.rng.choice(
-                        indices,
-                        self.max_failed_nodes - (self.total_nodes - np.sum(self.machine_status)),
-                        replace=False
-                    )
-
-                # Only if there is a node to fail, send a message
-                if len(indices) != 0:
-                    b = np.zeros(self.total_nodes)
-                    b[indices] = 1
-                    self.logger.tick(time.time()*100, b)
-                    # send the failure values to the respective nodes
-                    logging.info("[Status] Failed nodes {}".format(indices))
-                    host = '127.0.0.1'
-                    for port in self.ports:
-                        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        try:
-                            node_id = port - self.replica_base_port
-                            if port - self.replica_base_port in indices:
-                                failVal = "True"
-                                self.machine_status[node_id] = 0
-                                # thread to sleep for repair period and then change machine_status to alive
-                                start_new_thread(self.sleep_for_repair, (node_id, ))
-                            else:
-                                failVal = "True" if self.machine_status[port - self.replica_base_port] == 0 else "False"
-                            logging.info("[SEND] FailureMsg to: {}".format(node_id))
-                            message = str(FailureMessage(-2, 0, time.time()*100, failVal))
-                            s.connect((host, port))
-                            s.send(message.encode('ascii'))
-                            s.close()
-                        except Exception as msg:
-                            logging.error(str(msg) + " while connecting to {}".format(port))
-                            s.close()
-                time.sleep(self.fail_nodes_update)
+            self.clock.run(self.fail_nodes_process())
         except KeyboardInterrupt:
             print('Evironment is shutting down!')
-            make_dirs(join(self.exp_name))
-            self.logger.save(join(self.exp_name, 'env_failures.pbz2'))
+            self.save()
+
+
+    def save(self):
+        """Save the failures sampled so far"""
+        make_dirs(join(self.exp_name))
+        self.logger.save(join(self.exp_name, 'env_failures.pbz2'))
+        if self.trace is not None:
+            self.trace.close()
+
+
+    def fail_nodes_process(self):
+        """Fail up to f nodes every fail_nodes_update, yields the time to sleep"""
+        self.logger = FailureLogger(self.clock.now()*100, self.total_nodes, self.failure_probability,
+            **stream_kwargs(self.config, self.exp_name, 'env_failures'))
+        while self.run:
+            # Sample from binomial dist. (p = node failure prob.), we should
+            # fail atleast some nodes and at most self.max_failed_nodes
+            self.lock.acquire()
+            alive = self.machine_status == 1
+            self.lock.release()
+            indices = sample_failures(
+                self.rng,
+                self.failure_probability,
+                alive,
+                self.min_fail_fraction*self.max_failed_nodes,
+                self.max_failed_nodes
+            )
+
+            # Only if there is a node to fail, send a message
+            if len(indices) != 0:
+                b = np.zeros(self.total_nodes)
+                b[indices] = 1
+                self.logger.tick(self.clock.now()*100, b)
+                # send the failure values to the respective nodes
+                logging.info("[Status] Failed nodes {}".format(indices))
+                for port in self.ports:
+                    node_id = port - self.replica_base_port
+                    if b[node_id] == 1:
+                        failVal = "True"
+                        self.lock.acquire()
+                        self.machine_status[node_id] = 0
+                        self.lock.release()
+                        # change machine_status to alive after the repair period
+                        self.sleep_for_repair(node_id)
+                    else:
+                        failVal = "True" if self.machine_status[port - self.replica_base_port] == 0 else "False"
+                    logging.info("[SEND] FailureMsg to: {}".format(node_id))
+                    message = FailureMessage(-2, 0, self.clock.now()*100, failVal)
+                    self.send_unicast(message, port)
+            yield self.fail_nodes_update
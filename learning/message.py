@@ -1,5 +1,7 @@
 import ast
-import time
+import struct
+
+import numpy as np
 
 
 class Message():
@@ -16,27 +18,37 @@ class Message():
 
 
 class ShareEstimatesMessage(Message):
-    def __init__(self, id, leader, stamp, estimates):
-        """Share estimates with destination
+    def __init__(self, id, leader, stamp, estimates, counts, ids=None):
+        """Share estimates with destination, of all nodes (snapshot) or of
+        nodes ids only (delta)
 
             id: id of sender
             leader: id of leader
             stamp: time stamp
-            estimates: np.array of all node failure estimates
+            estimates: np.array of node failure estimates, sent as float16
+                if it is a float16 array and as float32 otherwise
+            counts: np.array of the number of observations of every estimate
+            ids: np.array of the nodes of estimates (None: all nodes)
         """
         super().__init__(id, leader, stamp)
         self.estimates = estimates
+        self.counts = counts
+        self.ids = ids
 
     def parse_estimates(self):
-        """Parse estimates if initialized as string"""
+        """Parse estimates, counts and ids if initialized as string"""
         self.estimates = ast.literal_eval(self.estimates)
+        self.counts = ast.literal_eval(self.counts)
+        self.ids = ast.literal_eval(self.ids)
 
     def __str__(self):
-        return('[Message]ShareEstimatesMsg {} {} {} {}'.format(
+        return('[Message]ShareEstimatesMsg {} {} {} [{}] [{}] {}'.format(
             self.sender,
             self.leader,
             self.stamp,
-            self.estimates
+            ','.join(str(i) for i in self.estimates),
+            ','.join(str(i) for i in self.counts),
+            None if self.ids is None else '[{}]'.format(','.join(str(i) for i in self.ids))
             ))
 
 
@@ -67,23 +79,26 @@ class ShareCandidatesMessage(Message):
 
 
 class ClientRequestMessage(Message):
-    def __init__(self, id, leader, stamp, requestId):
+    def __init__(self, id, leader, stamp, requestId, leaderStamp=0):
         """Client request message
 
             id: id of sender
-            leader: id of leader
+            leader: id of leader the client sends the request to
             stamp: time stamp
             requestId: request Id of the request
+            leaderStamp: time stamp of leader known to the client
         """
         super().__init__(id, leader, stamp)
         self.requestId = int(requestId)
+        self.leaderStamp = int(leaderStamp)
 
     def __str__(self):
-        return ('[Message]ClientRequestMsg {} {} {} {}'.format(
+        return ('[Message]ClientRequestMsg {} {} {} {} {}'.format(
             self.sender,
             self.leader,
             self.stamp,
-            self.requestId
+            self.requestId,
+            self.leaderStamp
             ))
 
 
@@ -149,6 +164,28 @@ class ResponseMessage(Message):
             ))
 
 
+class RedirectMessage(Message):
+    def __init__(self, id, leader, stamp, requestId):
+        """Reply to a request sent to a node that knows a newer leader than
+        the client
+
+            id: id of sender
+            leader: id of leader known to the sender
+            stamp: time stamp of that leader
+            requestId: request id of the request
+        """
+        super().__init__(id, leader, stamp)
+        self.requestId = int(requestId)
+
+    def __str__(self):
+        return ('[Message]RedirectMsg {} {} {} {}'.format(
+            self.sender,
+            self.leader,
+            self.stamp,
+            self.requestId
+            ))
+
+
 class ConfirmElectionMessage(Message):
     def __init__(self, id, leader, stamp):
         """Broadcast message to confirm sender is leader
@@ -186,6 +223,24 @@ class NewLeaderMessage(Message):
             ))
 
 
+class HeartbeatMessage(Message):
+    def __init__(self, id, leader, stamp):
+        """Periodic message of the leader to all nodes
+
+            id: id of sender
+            leader: id of leader
+            stamp: time stamp of the leader
+        """
+        super().__init__(id, leader, stamp)
+
+    def __str__(self):
+        return('[Message]HeartbeatMsg {} {} {}'.format(
+            self.sender,
+            self.leader,
+            self.stamp
+            ))
+
+
 class FailureMessage(Message):
     def __init__(self, id, leader, stamp, failureVal):
         """Environment fails destination node
@@ -256,7 +311,7 @@ def parse_and_construct(data):
 
     elif data.startswith("[Message]ClientRequestMsg"):
         data = data.split(" ")
-        message = ClientRequestMessage(data[1], data[2], data[3], data[4])
+        message = ClientRequestMessage(data[1], data[2], data[3], data[4], data[5])
 
     elif data.startswith("[Message]RequestBroadcastMsg"):
         data = data.split(" ")
@@ -272,7 +327,7 @@ def parse_and_construct(data):
 
     elif data.startswith("[Message]ShareEstimatesMsg"):
         data = data.split(" ")
-        message = ShareEstimatesMessage(data[1], data[2], data[3], data[4])
+        message = ShareEstimatesMessage(data[1], data[2], data[3], data[4], data[5], data[6])
         message.parse_estimates()
 
     elif data.startswith("[Message]PingMsg"):
@@ -291,8 +346,166 @@ def parse_and_construct(data):
         data = data.split(" ")
         message = NewLeaderMessage(data[1], data[2], data[3])
 
+    elif data.startswith("[Message]HeartbeatMsg"):
+        data = data.split(" ")
+        message = HeartbeatMessage(data[1], data[2], data[3])
+
+    elif data.startswith("[Message]RedirectMsg"):
+        data = data.split(" ")
+        message = RedirectMessage(data[1], data[2], data[3], data[4])
+
     else:
         # Error parsing message, received unknown
         message = None
 
-    return message
\ No newline at end of file
+    return message
+
+
+# Binary wire format: fixed header followed by an optional packed array.
+# header = payload length, type tag, sender, leader, stamp, field where field
+# is the requestId, the failure value or the number of array items.
+FRAME_HEADER = struct.Struct('<IBiiqi')
+
+# ClientRequestMessage payload: the leaderStamp
+LEADER_STAMP = struct.Struct('<q')
+
+# ShareEstimatesMessage payload: flags, then the ids (deltas only), the
+# estimates and the counts. Flags are ESTIMATES_SNAPSHOT for all nodes,
+# ESTIMATES_FLOAT32 for float32 estimates (float16 otherwise) and
+# ESTIMATES_IDS32 for uint32 ids (uint16 otherwise, up to 65536 nodes).
+ESTIMATES_SNAPSHOT = 1
+ESTIMATES_FLOAT32 = 2
+ESTIMATES_IDS32 = 4
+
+MESSAGE_TYPES = [
+    ConfirmElectionMessage,
+    ShareCandidatesMessage,
+    ClientRequestMessage,
+    RequestBroadcastMessage,
+    FailureMessage,
+    ResponseMessage,
+    ShareEstimatesMessage,
+    PingMessage,
+    PingReplyMessage,
+    ReplyBroadcastMessage,
+    NewLeaderMessage,
+    RedirectMessage,
+    HeartbeatMessage,
+]
+MESSAGE_TAGS = {cls: tag for tag, cls in enumerate(MESSAGE_TYPES)}
+REQUEST_TYPES = (ClientRequestMessage, RequestBroadcastMessage, ResponseMessage, ReplyBroadcastMessage,
+                 RedirectMessage)
+CANDIDATES_DTYPE = np.dtype('<i4')
+ESTIMATE_IDS_DTYPE = np.dtype('<u2')
+ESTIMATE_IDS32_DTYPE = np.dtype('<u4')
+ESTIMATE_COUNTS_DTYPE = np.dtype('<u4')
+
+
+def encode(message):
+    """Encode message into a length-prefixed binary frame"""
+    payload = b''
+    if isinstance(message, ClientRequestMessage):
+        payload = LEADER_STAMP.pack(message.leaderStamp)
+        field = message.requestId
+    elif isinstance(message, REQUEST_TYPES):
+        field = message.requestId
+    elif isinstance(message, FailureMessage):
+        field = int(message.failureVal == "True")
+    elif isinstance(message, ShareCandidatesMessage):
+        payload = np.asarray(message.candidates, dtype=CANDIDATES_DTYPE).tobytes()
+        field = len(payload) // CANDIDATES_DTYPE.itemsize
+    elif isinstance(message, ShareEstimatesMessage):
+        estimates = np.asarray(message.estimates)
+        flags = 0
+        if estimates.dtype == np.float16:
+            estimates = estimates.astype('<f2')
+        else:
+            estimates = estimates.astype('<f4')
+            flags |= ESTIMATES_FLOAT32
+        if message.ids is None:
+            flags |= ESTIMATES_SNAPSHOT
+            ids = b''
+        else:
+            ids = np.asarray(message.ids, dtype=np.int64)
+            if len(ids) > 0 and ids.min() < 0:
+                raise ValueError("Negative node id in estimates: {}".format(ids.min()))
+            if len(ids) > 0 and ids.max() > np.iinfo(ESTIMATE_IDS_DTYPE).max:
+                flags |= ESTIMATES_IDS32
+                ids = ids.astype(ESTIMATE_IDS32_DTYPE).tobytes()
+            else:
+                ids = ids.astype(ESTIMATE_IDS_DTYPE).tobytes()
+        payload = bytes([flags]) + ids + estimates.tobytes() \
+                    + np.asarray(message.counts, dtype=ESTIMATE_COUNTS_DTYPE).tobytes()
+        field = len(estimates)
+    else:
+        field = 0
+    header = FRAME_HEADER.pack(len(payload), MESSAGE_TAGS[type(message)],
+                               message.sender, message.leader, message.stamp, field)
+    return header + payload
+
+
+def decode(buffer, offset=0):
+    """Decode the frame starting at offset of buffer.
+
+    Arrays of ShareCandidatesMessage/ShareEstimatesMessage are views into
+    buffer, so buffer must not be modified afterwards (use bytes).
+
+    Returns
+    -------
+        (message, offset) of the next frame, message is None for an unknown
+        type and (None, offset) is returned unchanged if the frame is incomplete
+    """
+    if len(buffer) - offset < FRAME_HEADER.size:
+        return None, offset
+    length, tag, sender, leader, stamp, field = FRAME_HEADER.unpack_from(buffer, offset)
+    end = offset + FRAME_HEADER.size + length
+    if len(buffer) < end:
+        return None, offset
+
+    cls = MESSAGE_TYPES[tag] if tag < len(MESSAGE_TYPES) else None
+    start = offset + FRAME_HEADER.size
+    if cls is None:
+        # Error parsing message, received unknown
+        message = None
+    elif cls is ClientRequestMessage:
+        message = ClientRequestMessage(sender, leader, stamp, field, LEADER_STAMP.unpack_from(buffer, start)[0])
+    elif cls in REQUEST_TYPES:
+        message = cls(sender, leader, stamp, field)
+    elif cls is FailureMessage:
+        message = FailureMessage(sender, leader, stamp, "True" if field else "False")
+    elif cls is ShareCandidatesMessage:
+        message = ShareCandidatesMessage(sender, leader, stamp,
+            np.frombuffer(buffer, CANDIDATES_DTYPE, field, start))
+    elif cls is ShareEstimatesMessage:
+        flags = buffer[start]
+        start += 1
+        ids = None
+        if not flags & ESTIMATES_SNAPSHOT:
+            ids_dtype = ESTIMATE_IDS32_DTYPE if flags & ESTIMATES_IDS32 else ESTIMATE_IDS_DTYPE
+            ids = np.frombuffer(buffer, ids_dtype, field, start)
+            start += field*ids_dtype.itemsize
+        dtype = np.dtype('<f4') if flags & ESTIMATES_FLOAT32 else np.dtype('<f2')
+        estimates = np.frombuffer(buffer, dtype, field, start)
+        counts = np.frombuffer(buffer, ESTIMATE_COUNTS_DTYPE, field, start + field*dtype.itemsize)
+        message = ShareEstimatesMessage(sender, leader, stamp, estimates, counts, ids)
+    else:
+        message = cls(sender, leader, stamp)
+    return message, end
+
+
+def decode_frames(buffer):
+    """Decode all complete frames of buffer.
+
+    Returns
+    -------
+        (messages, consumed): decoded messages and number of bytes used, the
+        rest of buffer is the start of an incomplete frame
+    """
+    messages = []
+    offset = 0
+    while True:
+        message, end = decode(buffer, offset)
+        if end == offset:
+            return messages, offset
+        messages.append(message)
+        offset = end
@@ -1,26 +1,45 @@
-import time
+from .clock import WallClock
+from .message import MESSAGE_TAGS, MESSAGE_TYPES
+from .transport import TcpTransport
+from utils.logger import TRACE_EVENTS, TRACE_RECV, TRACE_SEND, event_trace
 
 
 class Node(object):
-    def __init__(self, id, n, config, exp_name=None):
+    def __init__(self, id, n, config, exp_name=None, clock=None, transport=None):
         """Initialize node
 
             id: Node id
             n: total number of nodes
             config: config parameters
+            clock: time source (default: WallClock)
+            transport: message transport (default: TcpTransport)
         """ 
         self.id = id
         self.total_nodes = n
         self.ports = [int(config.port.replica_base_port) + i for i in range(n)]
         self.exp_name = "{}_{}".format(self.total_nodes, config.mab.algo) \
                             if exp_name is None else exp_name
+        self.clock = WallClock() if clock is None else clock
+        self.transport = TcpTransport() if transport is None else transport
 
         # client port
         self.client_port = config.port.client_port
         self.config = config
 
         # [timestamp, Initial Leader ID]
-        self.leader = {'stamp': time.time()*100, 'id': 0}
+        self.leader = {'stamp': 0, 'id': 0}
+
+        # Called once the node is listening on its port (e.g. by a launcher)
+        self.on_listening = None
+        # Called once the node stopped (e.g. to stop the event loop it runs on)
+        self.on_stopped = None
+
+        # Binary trace of the messages sent and received (log.trace), peers
+        # are node ids, -1 for the client
+        self.trace = event_trace(config, self.exp_name, 'client' if id < 0 else 'node_{}'.format(id),
+                                 {'events': TRACE_EVENTS, 'messages': [cls.__name__ for cls in MESSAGE_TYPES]})
+        self.port_ids = {port: i for i, port in enumerate(self.ports)}
+        self.port_ids[self.client_port] = -1
 
 
     def send(self):
@@ -28,6 +47,41 @@ class Node(object):
         pass
 
 
+    def send_unicast(self, message, port):
+        """Send point-to-point message, returns False if it could not be sent"""
+        sent = self.transport.send(message, port)
+        if sent and self.trace is not None:
+            self.record_event(TRACE_SEND, message, self.port_ids.get(port, -1))
+        return sent
+
+
+    def send_multicast(self, messages, ports):
+        """Send all messages to each of ports"""
+        self.transport.multicast(messages, ports)
+        if self.trace is not None:
+            for port in ports:
+                for message in messages:
+                    self.record_event(TRACE_SEND, message, self.port_ids.get(port, -1))
+
+
+    def receive(self, message):
+        """Trace and handle a message received on our port"""
+        if message is not None and self.trace is not None:
+            self.record_event(TRACE_RECV, message, message.sender)
+        self.handle_message(message)
+
+
+    def record_event(self, event, message, peer):
+        """Add a message sent to or received from peer to the trace"""
+        self.trace.record(self.clock.now(), self.id, event, MESSAGE_TAGS[type(message)], peer,
+                          getattr(message, 'requestId', -1), self.leader['id'])
+
+
+    def handle_message(self, message):
+        """Act on a parsed message"""
+        pass
+
+
     def receive_messages(self):
         """Receive messages from other nodes"""
         pass
@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import logging
+import time
+
+from .transport import Transport
+from .environment_v2 import Environmentv2
+from .v2 import v2
+from .client import Client
+from utils.logger import make_dirs, setup_logging
+
+
+class Wakeup():
+    def __init__(self, sim):
+        """Resumes the process waiting on it when set (or after the timeout
+        of the wait), in virtual time"""
+        self.sim = sim
+        self.is_set = False
+        self.process = None
+        self.waits = 0
+
+    def set(self):
+        if self.process is not None:
+            process, self.process = self.process, None
+            self.sim.call_later(0, self.sim._step, process)
+        else:
+            self.is_set = True
+
+    def wait(self, process, timeout=None):
+        if self.is_set:
+            self.is_set = False
+            self.sim.call_later(0, self.sim._step, process)
+        else:
+            self.process = process
+            self.waits += 1
+            if timeout is not None:
+                self.sim.call_later(timeout, self._timeout, self.waits)
+
+    def _timeout(self, wait):
+        # Only if the process is still in the same wait
+        if self.process is not None and self.waits == wait:
+            process, self.process = self.process, None
+            self.sim._step(process)
+
+
+class Simulator(Transport):
+    def __init__(self, latency=0.001, start=None):
+        """Discrete-event simulator with a virtual clock.
+
+        Used as both the clock and the transport of the nodes, client and
+        environment so that they run in a single process: sleeps yielded by
+        their processes and call_later timers become timestamped events, and
+        send schedules the delivery of the message after a fixed network
+        latency.
+
+            latency: message delivery delay in (virtual) seconds
+            start: initial virtual time (default: current wall time)
+        """
+        self.latency = latency
+        self._now = time.time() if start is None else start
+        self._events = []
+        self._seq = itertools.count()
+        self._receivers = {}
+        self.stopped = False
+
+    def now(self):
+        """Current virtual time in seconds"""
+        return self._now
+
+    def call_later(self, delay, fn, *args):
+        """Schedule fn(*args) delay seconds from now"""
+        heapq.heappush(self._events, (self._now + delay, next(self._seq), fn, args))
+
+    def run(self, process):
+        """Start a process, resumed after each yielded sleep duration.
+
+        Args
+        ----
+            process (generator): yields sleep durations in seconds, a wakeup
+                or (wakeup, timeout)
+        """
+        self.call_later(0, self._step, process)
+
+    def _step(self, process):
+        try:
+            delay = next(process)
+        except StopIteration:
+            return
+        if isinstance(delay, Wakeup):
+            delay.wait(process)
+        elif isinstance(delay, tuple):
+            delay[0].wait(process, delay[1])
+        else:
+            self.call_later(delay, self._step, process)
+
+    def wakeup(self):
+        """Wakeup a process can yield to sleep until it is set"""
+        return Wakeup(self)
+
+    def listen(self, port, handler, ready=None):
+        """Register handler for messages delivered to port (non-blocking)"""
+        self._receivers[port] = handler
+        if ready is not None:
+            ready()
+
+    def send(self, message, port):
+        """Deliver message to the handler listening on port after latency"""
+        if port not in self._receivers:
+            logging.error("Unable to send message {} to port {}".format(message, port))
+            return False
+        self.call_later(self.latency, self._deliver, port, message)
+        return True
+
+    def _deliver(self, port, message):
+        self._receivers[port](message)
+
+    def stop(self):
+        """Stop the event loop after the current event"""
+        self.stopped = True
+
+    def simulate(self, until=None):
+        """Process events in time order.
+
+        Args
+        ----
+            until (float): virtual time to stop at (default: until stop())
+        """
+        self.stopped = False
+        while self._events and not self.stopped:
+            if until is not None and self._events[0][0] > until:
+                self._now = until
+                break
+            self._now, _, fn, args = heapq.heappop(self._events)
+            fn(*args)
+
+
+def simulate_cluster(config, exp_name=None):
+    """Run the environment, all v2 nodes and the client of config in one
+    process on virtual time, returns the client once all requests are served.
+    """
+    n = config.num_nodes
+    exp_name = "{}_{}".format(n, config.mab.algo) if exp_name is None else exp_name
+    make_dirs('logs')
+    setup_logging(config, '%(asctime)s %(levelname)-8s [SIM] %(funcName)s() %(message)s',
+                  'logs/sim_{}.log'.format(exp_name), console=False)
+
+    sim = Simulator(config.get('sim', {}).get('latency', 0.001))
+    env = Environmentv2(n, config, exp_name, clock=sim, transport=sim)
+    nodes = [v2(i, n, config, exp_name, clock=sim, transport=sim) for i in range(n)]
+    client = Client(-1, n, config, exp_name, clock=sim, transport=sim)
+
+    for node in nodes:
+        node.start()
+    env.run = True
+    sim.run(env.fail_nodes_process())
+    client.start()
+
+    # Run until the client has sent all requests
+    def wait_for_client():
+        while client.run:
+            yield 1
+        sim.stop()
+    sim.run(wait_for_client())
+    sim.simulate()
+
+    # Let the nodes process the last request and shut themselves down
+    sim.simulate(until=sim.now() + 10)
+    for node in nodes:
+        if node.run:
+            node.stop_node()
+    env.run = False
+    env.save()
+    return client
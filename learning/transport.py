@@ -0,0 +1,190 @@
+import logging
+import queue
+import socket
+import threading
+from _thread import *
+
+from .message import encode, decode_frames
+
+
+class Transport():
+    """Delivers Message objects between the nodes, client and environment.
+
+    Every component sends with send(message, port) and receives by handing a
+    callback to listen(port, handler), which is called once per message. The
+    optional ready() callback of listen is called once port accepts messages.
+    """
+
+    def send(self, message, port):
+        """Send message to port, returns False if it could not be sent"""
+        raise NotImplementedError
+
+    def multicast(self, messages, ports):
+        """Send all messages to every port in ports"""
+        for port in ports:
+            for message in messages:
+                self.send(message, port)
+
+    def listen(self, port, handler, ready=None):
+        """Call handler(message) for every message received on port"""
+        raise NotImplementedError
+
+    def close(self):
+        """Stop listening"""
+        pass
+
+
+class PeerConnection():
+    def __init__(self):
+        """Persistent connection to one peer, sends are serialized by lock"""
+        self.lock = threading.Lock()
+        self.socket = None
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+class TcpTransport(Transport):
+    def __init__(self, host='127.0.0.1'):
+        """TCP transport keeping one persistent connection per peer port.
+
+        Messages are sent as length-prefixed binary frames so that the
+        receiver can read many of them from one stream, a broken connection is
+        re-established on the next send.
+
+            host: address all ports are bound on
+        """
+        self.host = host
+        self.closed = False
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def _connection(self, port):
+        with self.lock:
+            if port not in self.connections:
+                self.connections[port] = PeerConnection()
+            return self.connections[port]
+
+    def send(self, message, port):
+        return self._write(encode(message), port, [message])
+
+    def multicast(self, messages, ports):
+        """Encode messages once and write all of them to each peer at once"""
+        data = b''.join(encode(message) for message in messages)
+        for port in ports:
+            self._write(data, port, messages)
+
+    def _write(self, data, port, messages):
+        connection = self._connection(port)
+        with connection.lock:
+            # Retry once on a fresh connection if the peer dropped the old one
+            for _ in range(2):
+                try:
+                    if connection.socket is None:
+                        connection.socket = socket.create_connection((self.host, port))
+                        connection.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    connection.socket.sendall(data)
+                    return True
+                except OSError:
+                    connection.close()
+        logging.error("Unable to send message %s to port %s",
+                      ' '.join(str(message) for message in messages), port)
+        return False
+
+    def listen(self, port, handler, ready=None):
+        """Accept connections on port until closed (blocking)"""
+        receiving_socket = socket.socket()
+        # Allow restarting on a port with connections still in TIME_WAIT
+        receiving_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            receiving_socket.bind((self.host, port))
+        except socket.error as e:
+            logging.error(str(e))
+            return
+        receiving_socket.listen(5)
+        if ready is not None:
+            ready()
+        while not self.closed:
+            connection, _ = receiving_socket.accept()
+            start_new_thread(self.multi_threaded_client, (connection, handler))
+
+    def multi_threaded_client(self, connection, handler):
+        """Read messages from the socket until the peer disconnects.
+
+        Args
+        ----
+            connection: socket connection
+            handler: callback for the parsed messages
+        """
+        buffer = b''
+        while True:
+            try:
+                data = connection.recv(65536)
+            except OSError:
+                break
+
+            # If the peer closed the connection
+            if not data:
+                break
+
+            # Decode every complete frame, keep the partial one
+            if buffer:
+                data = buffer + data
+            messages, consumed = decode_frames(data)
+            buffer = data[consumed:]
+            for message in messages:
+                handler(message)
+
+        connection.close()
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            for connection in self.connections.values():
+                with connection.lock:
+                    connection.close()
+
+
+class LoopbackTransport(Transport):
+    def __init__(self):
+        """In-memory transport for running a whole cluster in one process.
+
+        Message objects are put on a queue per port and handed to the
+        listener as is, without serialization or sockets. Share a single
+        instance between all components.
+        """
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _queue(self, port):
+        with self.lock:
+            if port not in self.queues:
+                self.queues[port] = queue.Queue()
+            return self.queues[port]
+
+    def send(self, message, port):
+        if self.closed:
+            logging.error("Unable to send message {} to port {}".format(message, port))
+            return False
+        self._queue(port).put(message)
+        return True
+
+    def listen(self, port, handler, ready=None):
+        """Handle messages queued for port until closed (blocking)"""
+        messages = self._queue(port)
+        if ready is not None:
+            ready()
+        while True:
+            message = messages.get()
+            if message is None:
+                break
+            handler(message)
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            for messages in self.queues.values():
+                messages.put(None)
@@ -1,21 +1,19 @@
-import time
 from os.path import join
 import numpy as np
 from numpy.random import default_rng
 from enum import Enum
 
 from .node import Node
+from .bandit import TopKIndex, BetaPosterior, DiscountedMean, WindowMean
+from .detector import PhiAccrualDetector
+from .election import VoteTally
+from .window import RequestWindow
 from .message import *
-from utils.logger import FailureEstimatesLogger, make_dirs
-from _thread import *
+from utils.logger import FailureEstimatesLogger, make_dirs, stream_kwargs, setup_logging
 import threading
-import socket
 import logging
 
 
-lock = threading.Lock()
-
-
 class Election_Algorithm(Enum):
     DETERMINISITC = 1
     RANDOM = 2
@@ -23,14 +21,23 @@ class Election_Algorithm(Enum):
 
 
 class v2(Node):
-    def __init__(self, id, n, config, exp_name):
+    def __init__(self, id, n, config, exp_name, clock=None, transport=None):
         """Initialize node
 
             id: Node id
             n: total number of nodes
             config: config parameters
+            clock: time source (default: WallClock)
+            transport: message transport (default: TcpTransport)
         """
-        super().__init__(id, n, config, exp_name)
+        super().__init__(id, n, config, exp_name, clock, transport)
+
+        # Locks of this node: node state (status, leader, votes, pings,
+        # message buffer), the out_queue, and the failure estimates
+        # (failure_estimates, arm_counts, node_count, t, penalize_values)
+        self.lock = threading.Lock()
+        self.out_lock = threading.Lock()
+        self.estimates_lock = threading.Lock()
 
         # Node properties
         self.is_failed = False
@@ -45,9 +52,11 @@ class v2(Node):
         self.arm_counts = np.zeros((self.total_nodes))
         self.t = 0
 
-        # Messages buffer and out queue
+        # Messages buffer and out queue, the broadcaster sleeps until woken up
         self.out_queue = []
-        self.message_buffer = {i: {} for i in range(config.num_nodes)}
+        self.out_wakeup = self.clock.wakeup()
+        self.message_buffer = {i: RequestWindow(config.node.get('request_window', 1024))
+                               for i in range(config.num_nodes)}
         self.curret_leader_message = None
 
         # Keep track of how many times a node estimate is updated
@@ -55,9 +64,12 @@ class v2(Node):
 
         # Node port
         self.my_receving_port = self.ports[id]
+        self.peer_ports = [port for port in self.ports if port != self.my_receving_port]
 
-        # Candidate buffers
-        self.candidates = []
+        # Candidate votes per leader being replaced, decided once a majority
+        # of the nodes (including us) voted, and again in every retry round
+        self.tallies = {}
+        self.quorum = self.total_nodes // 2 + 1
         self.my_candidates = []
         self.seed = config.random_seed
 
@@ -70,6 +82,41 @@ class v2(Node):
         self.penalize_values = np.zeros((self.total_nodes))
         self.request_broadcast_id = None
 
+        # Failure detector fed by the heartbeats the leader sends every
+        # heartbeat_sec (0: no heartbeats), pings are too irregular to share
+        # their distribution. Followers suspecting the leader (phi above
+        # phi_threshold) start an election, again after election_timeout if
+        # no new leader was elected. Client broadcasts for a leader suspected
+        # less than election_timeout ago join that election instead
+        self.heartbeat_sec = config.node.get('heartbeat_sec', 0)
+        self.phi_threshold = config.node.get('phi_threshold', 8)
+        self.election_timeout = config.node.get('election_timeout', 5)
+        self.detector = PhiAccrualDetector(self.total_nodes, config.node.get('phi_window', 100),
+                                           config.node.get('phi_min_std', 0.05))
+        self.watched_leader = None
+        # (leader, time) of the last election started because of leader
+        self.election_started = None
+
+        # Gossip (off unless gossip_fanout > 0): every gossip_sec the
+        # estimates of our own observations go to gossip_fanout random
+        # peers, only the ones that changed since the last exchange with the
+        # peer and all of them every gossip_snapshot exchanges. The
+        # observations of every peer merged so far are kept so that only new
+        # ones are merged
+        self.gossip_sec = config.node.get('gossip_sec', 1)
+        self.gossip_fanout = config.node.get('gossip_fanout', 0)
+        self.gossip_snapshot = config.node.get('gossip_snapshot', 10)
+        self.gossip_dtype = np.dtype(config.node.get('gossip_dtype', 'float16'))
+        self.gossip_rng = default_rng([self.seed, self.id])
+        self.gossip_peers = np.array([i for i in range(n) if i != id])
+        self.gossip_sent = np.zeros((n, n))
+        self.gossip_exchanges = np.zeros(n, dtype=int)
+        self.own_failures = np.zeros(n)
+        self.own_counts = np.zeros(n)
+        self.peer_failures = np.zeros((n, n))
+        self.peer_counts = np.zeros((n, n))
+        self.peer_stamps = np.zeros(n)
+
 
         # Set failure estimate of all nodes (noisy)
         self.failure_estimates = self.rng.normal(
@@ -77,7 +124,34 @@ class v2(Node):
             config.failure_estimates.std,
             self.total_nodes
         )
-        self.fail_est_logger = FailureEstimatesLogger(time.time()*100, self.failure_estimates)
+        self.fail_est_logger = FailureEstimatesLogger(self.clock.now()*100, self.failure_estimates,
+            **stream_kwargs(config, self.exp_name, 'failEst_{}'.format(self.id)))
+
+        # Estimates are the mean of all observations (default), or for
+        # non-stationary failures a discounted or sliding window mean
+        if config.mab.get('estimator', 'mean') == 'discounted':
+            self.estimator = DiscountedMean(self.failure_estimates, config.mab.get('gamma', 0.99))
+        elif config.mab.get('estimator', 'mean') == 'window':
+            self.estimator = WindowMean(self.failure_estimates, config.mab.get('window', 100))
+        else:
+            self.estimator = None
+
+        # Nodes ranked by candidate score, the observed node is re-ranked on
+        # every update. UCB bonuses of the other nodes are refreshed once
+        # log(t) grew by the fraction mab.refresh, or with a discounted/window
+        # estimator every mab.estimator_refresh of its memory. Their
+        # estimates do not change in between, only the bonuses do: a
+        # discounted count fades by gamma per observation, so the bonus is
+        # stale by at most gamma^(-refresh*memory/2) - 1 (5% by default)
+        self.ucb_refresh = config.mab.get('refresh', 0.01)
+        self.estimator_refresh = config.mab.get('estimator_refresh', 0.1)
+        self.candidate_index = TopKIndex(self._candidate_scores())
+        self.index_log_t = 0
+        self.index_t = 0
+
+        # Thompson sampling: Beta posterior of the failure probability of
+        # every node, fed by the same observations as the estimates
+        self.posterior = BetaPosterior(self.total_nodes, config.mab.get('prior', (1, 1)))
 
         # Leader election algorithm type
         if config.election_algorithm == 'Deterministic':
@@ -87,13 +161,44 @@ class v2(Node):
         else:
             self.election_algorithm = Election_Algorithm.LEARNING
 
-        logging.basicConfig(level=logging.INFO,
-            format='%(asctime)s %(levelname)-8s [Node {}] %(funcName)s() %(message)s'.format(self.id),
-            datefmt='%Y-%m-%d %H:%M:%S', handlers=[
-                logging.FileHandler('logs/node_{}_{}.log'.format(self.id, self.exp_name)),
-                logging.StreamHandler()
-                ]
-        )
+        setup_logging(config,
+            '%(asctime)s %(levelname)-8s [Node {}] %(funcName)s() %(message)s'.format(self.id),
+            'logs/node_{}_{}.log'.format(self.id, self.exp_name))
+
+
+    def _candidate_scores(self, ids=slice(None)):
+        """Scores of nodes ids (default: all), the lowest are proposed first"""
+        score = self.failure_estimates[ids]
+        if self.explore_exploit in ('egreedy', 'UCB-penalize'):
+            score = score + self.penalize_values[ids]
+        if self.explore_exploit in ('UCB', 'UCB-penalize'):
+            score = score - self._ucb_bonus(ids)
+        return score
+
+
+    def _ucb_bonus(self, ids=slice(None)):
+        """UCB exploration bonus of nodes ids (default: all)"""
+        if self.estimator is None:
+            counts, t = self.arm_counts[ids], self.t
+        else:
+            counts, t = self.estimator.counts(ids), self.estimator.horizon()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.tradeoff*np.sqrt(np.log(t)/counts)
+
+
+    def _update_candidate_index(self, id):
+        """Re-rank node id after its estimate, count or penalty changed"""
+        self.candidate_index.update(id, self._candidate_scores(id))
+        if self.explore_exploit not in ('UCB', 'UCB-penalize'):
+            return
+        if self.estimator is None:
+            stale = self.t > 1 and np.log(self.t) > self.index_log_t*(1 + self.ucb_refresh)
+        else:
+            stale = self.t - self.index_t >= self.estimator_refresh*self.estimator.memory
+        if stale:
+            self.candidate_index.rebuild(self._candidate_scores())
+            self.index_log_t = np.log(self.t)
+            self.index_t = self.t
 
 
     def _select_node_exploitation(self, topn:int = 1):
@@ -120,30 +225,41 @@ class v2(Node):
                 else:
                     ids = ids[:topn]
             else:
-                ids = (-self.failure_estimates - self.penalize_values).argsort()[-topn:]
+                self.estimates_lock.acquire()
+                ids = self.candidate_index.smallest(topn)
+                self.estimates_lock.release()
             self.epsilon *= self.decay
             ids = np.sort(ids)
-            lock.acquire()
+            self.lock.acquire()
             self.my_candidates = ids
-            lock.release()
+            self.lock.release()
             return ids
         elif self.explore_exploit == 'UCB':
-            choice = (
-                self.failure_estimates
-                - self.tradeoff*np.sqrt(np.log(self.t)/self.arm_counts)
-            ).argsort()[:topn]
-            lock.acquire()
+            self.estimates_lock.acquire()
+            choice = self.candidate_index.smallest(topn)
+            self.estimates_lock.release()
+            self.lock.acquire()
             self.my_candidates = list(choice)
-            lock.release()
+            self.lock.release()
             return choice
         elif self.explore_exploit == 'UCB-penalize':
-            choice = (
-                self.failure_estimates + self.penalize_values
-                - self.tradeoff*np.sqrt(np.log(self.t)/self.arm_counts)
-            ).argsort()[:topn]
-            lock.acquire()
+            self.estimates_lock.acquire()
+            choice = self.candidate_index.smallest(topn)
+            self.estimates_lock.release()
+            self.lock.acquire()
+            self.my_candidates = list(choice)
+            self.lock.release()
+            return choice
+        elif self.explore_exploit == 'Thompson':
+            # Propose the nodes with the lowest sampled failure probability
+            self.estimates_lock.acquire()
+            draws = self.posterior.sample(self.rng) + self.penalize_values
+            self.estimates_lock.release()
+            choice = np.argpartition(draws, topn - 1)[:topn]
+            choice = choice[np.argsort(draws[choice])]
+            self.lock.acquire()
             self.my_candidates = list(choice)
-            lock.release()
+            self.lock.release()
             return choice
 
 
@@ -152,238 +268,405 @@ class v2(Node):
         # if self.explore_exploit == 'egreedy':
         #     return self.rng.choice(self.total_nodes, size=1, replace=False)[0]
         # elif self.explore_exploit == 'UCB':
-        choice = np.argmax(
-              self.failure_estimates + self.tradeoff*np.sqrt(np.log(self.t)/self.arm_counts)
-        )
+        self.estimates_lock.acquire()
+        choice = np.argmax(self.failure_estimates + self._ucb_bonus())
+        self.estimates_lock.release()
         # self.arm_counts[choice] += 1
         return choice
 
     def penalize(self):
         # Penalize the local_leader which was selected  but isn't alive so that it doesn't get selected again
+        if self.local_leader is None:
+            # Only the learning based election selects a local_leader
+            return
+        self.estimates_lock.acquire()
         self.penalize_values[self.local_leader] += 0.5
-        logging.info("Penalizing {}, values = {}".format(self.local_leader, self.penalize_values))
-
-
-    def send_unicast(self, message, port):
-        """Send point-to-point message"""
-        host = '127.0.0.1'
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            s.connect((host, port))
-            s.send(message.encode('ascii'))
-            s.close()
-        except Exception as msg:
-            logging.error("Unable to send message {} to port {}".format(message, port))
-            s.close()
+        self._update_candidate_index(self.local_leader)
+        self.estimates_lock.release()
+        logging.info("Penalizing %s, values = %s", self.local_leader, self.penalize_values)
 
 
     def send_ping_message(self):
         """Send ping message to any random node"""
+        self.clock.run(self.ping_process())
+
+
+    def ping_process(self):
+        """Ping a node every ping_sleep_sec, yields the time to sleep"""
         self.ping_replies = False
-        host = '127.0.0.1'
         while self.run:
-            time.sleep(self.ping_sleep_sec)
+            yield self.ping_sleep_sec
             if self.is_failed:
                 continue
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            try:
-                # Select a node to send ping message -- bandit exploration
-                node = self._select_node_exploration()
-                port = self.ports[node]
-                s.connect((host, port))
-                lock.acquire()
-                self.ping_replies = True
-                lock.release()
-                logging.info("[SEND][FailEst] [Message]PingMsg to: {}".format(node))
-                message = str(PingMessage(self.id, -100, time.time()*100))
-                s.send(message.encode('ascii'))
-                s.close()
-            except Exception as msg:
-                logging.error("Unable to send ping message to node {} {}".format(node, msg))
-                s.close()
+            # Select a node to send ping message -- bandit exploration
+            node = self._select_node_exploration()
+            self.lock.acquire()
+            self.ping_replies = True
+            self.lock.release()
+            logging.info("[SEND][FailEst] [Message]PingMsg to: %s", node)
+            message = PingMessage(self.id, -100, self.clock.now()*100)
+            if not self.send_unicast(message, self.ports[node]):
+                self.lock.acquire()
+                self.ping_replies = False
+                self.lock.release()
 
             # Sleep for a bit before expecting reply
-            time.sleep(self.ping_sleep_reply)
+            yield self.ping_sleep_reply
 
             # check if we received a reply
             if self.ping_replies:
                 self.update_failure_estimate_up(node)
-                lock.acquire()
+                self.lock.acquire()
                 self.ping_replies = False
-                lock.release()
+                self.lock.release()
 
 
     def receive_ping_reply_message(self, message):
         """Receive ping reply message, update failure prob. (down)"""
-        lock.acquire()
+        self.lock.acquire()
         self.ping_replies = False
-        lock.release()
+        self.lock.release()
         self.update_failure_estimate_down(message.sender)
+        self.estimates_lock.acquire()
         self.penalize_values[message.sender] = 0
-        logging.info("[RECV] [Message]PingReplyMsg from: {} @ {}, msg: {}".format(message.sender, message.stamp, message))
+        self._update_candidate_index(message.sender)
+        self.estimates_lock.release()
+        logging.info("[RECV] [Message]PingReplyMsg from: %s @ %s, msg: %s", message.sender, message.stamp, message)
 
 
-    def send_broadcast(self):
-        """Send message in the out_buffer to other nodes"""
-        while self.run:
-            # if we are faulty, do not send anything
+    def send_heartbeats(self):
+        """Send heartbeats (leader) or check the leader (followers)"""
+        self.clock.run(self.heartbeat_process())
+
+
+    def heartbeat_process(self):
+        """Every heartbeat_sec the leader sends a heartbeat to all nodes and
+        the followers check if they suspect the leader, yields the time to
+        sleep"""
+        while self.run and self.heartbeat_sec > 0:
+            yield self.heartbeat_sec
             if self.is_failed:
-                pass
+                continue
+            if self.leader['id'] == self.id:
+                self.broadcast(HeartbeatMessage(self.id, self.id, self.leader['stamp']))
             else:
-                host = '127.0.0.1'
-                # clear our out_buffer
-                while len(self.out_queue) > 0:
-                    message = self.out_queue.pop()
-                    # Broadcast to all other nodes
-                    receiver = self.ports
-                    for port in receiver:
-                        if port != self.my_receving_port:
-                            self.send_unicast(message, port)
-            time.sleep(1)
-
-
-    def multi_threaded_client(self, connection):
-        """Read from the socket until no more messages are available.
-        
+                self.check_leader()
+
+
+    def check_leader(self):
+        """Start an election if we suspect the leader failed"""
+        now = self.clock.now()
+        leader = int(self.leader['id'])
+        self.lock.acquire()
+        if leader != self.watched_leader:
+            # Expect heartbeats of the new leader from now on
+            self.watched_leader = leader
+            self.detector.reset(leader, now, self.heartbeat_sec)
+        phi = self.detector.phi(leader, now)
+        started = self.election_started
+        retry = started is not None and started[0] == leader
+        if phi < self.phi_threshold or (retry and now - started[1] < self.election_timeout):
+            self.lock.release()
+            return
+        self.election_started = (leader, now)
+        self.lock.release()
+
+        logging.info("[FailDetect] Suspecting leader %s (phi = %.2f)", leader, phi)
+        # The last election did not replace the leader, its candidate failed
+        if retry and self.local_leader is not None:
+            self.penalize()
+        if self.election_algorithm != Election_Algorithm.LEARNING:
+            # The learning based election updates the estimate itself
+            self.update_failure_estimate_up(leader)
+        self.start_election()
+
+
+    def receive_heartbeat(self, message):
+        """Heartbeat of the leader"""
+        self.lock.acquire()
+        self.detector.heartbeat(message.sender, self.clock.now())
+        self.lock.release()
+
+
+    def send_gossip(self):
+        """Send the estimates of our own observations to random peers"""
+        self.clock.run(self.gossip_process())
+
+
+    def gossip_process(self):
+        """Every gossip_sec send the estimates and counts of our own
+        observations to gossip_fanout random peers, yields the time to sleep.
+
+        A peer gets the nodes whose counts changed since our last message
+        to it, and all nodes every gossip_snapshot messages to resync after
+        lost messages.
+        """
+        while self.run and self.gossip_fanout > 0:
+            yield self.gossip_sec
+            if self.is_failed:
+                continue
+            self.estimates_lock.acquire()
+            counts = self.own_counts.copy()
+            failures = self.own_failures.copy()
+            self.estimates_lock.release()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                estimates = np.where(counts > 0, failures/counts, 0).astype(self.gossip_dtype)
+            peers = self.gossip_rng.choice(self.gossip_peers,
+                size=min(self.gossip_fanout, len(self.gossip_peers)), replace=False)
+            for peer in peers:
+                if self.gossip_exchanges[peer] % self.gossip_snapshot == 0:
+                    ids = None
+                    message = ShareEstimatesMessage(self.id, self.leader['id'], self.clock.now()*100,
+                                                    estimates, counts)
+                else:
+                    ids = np.flatnonzero(counts != self.gossip_sent[peer])
+                    if len(ids) == 0:
+                        continue
+                    message = ShareEstimatesMessage(self.id, self.leader['id'], self.clock.now()*100,
+                                                    estimates[ids], counts[ids], ids)
+                self.gossip_exchanges[peer] += 1
+                self.gossip_sent[peer] = counts
+                logging.info("[SEND][Gossip] ShareEstimatesMsg to: %s, nodes: %s",
+                             peer, 'all' if ids is None else ids)
+                self.send_unicast(message, self.ports[peer])
+
+
+    def receive_estimates_msg(self, message):
+        """Merge the estimates of the observations of the sender into ours,
+        weighted by their counts. Only the observations made since its last
+        message are merged so that none is counted twice.
+
         Args
         ----
-            connection: socket connection
+            message (Message): ShareEstimates message
         """
-        while True:
-            data = str(connection.recv(2048).decode('ascii'))
-
-            # If there is no message
-            if not data:
-                break
+        sender = message.sender
+        ids = np.arange(self.total_nodes) if message.ids is None else np.asarray(message.ids, dtype=int)
+        counts = np.asarray(message.counts, dtype=float)
+        failures = np.asarray(message.estimates, dtype=float)*counts
+
+        self.estimates_lock.acquire()
+        if message.stamp <= self.peer_stamps[sender]:
+            # Reordered, we merged a newer one already
+            self.estimates_lock.release()
+            return
+        self.peer_stamps[sender] = message.stamp
+        new_counts = counts - self.peer_counts[sender, ids]
+        new_failures = failures - self.peer_failures[sender, ids]
+        self.peer_counts[sender, ids] = counts
+        self.peer_failures[sender, ids] = failures
+        changed = new_counts > 0
+        ids = ids[changed]
+        new_counts = new_counts[changed]
+        new_failures = np.clip(new_failures[changed], 0, new_counts)
+
+        # The discounted and window estimates only follow our own
+        # observations, the mean and the posterior take all of them
+        if self.estimator is None:
+            self.failure_estimates[ids] = (self.failure_estimates[ids]*self.node_count[ids] + new_failures) \
+                                            / (self.node_count[ids] + new_counts)
+            self.node_count[ids] += new_counts
+            self.arm_counts[ids] += new_counts
+            self.t += int(np.sum(new_counts))
+        self.posterior.alpha[ids] += new_failures
+        self.posterior.beta[ids] += new_counts - new_failures
+        for id in ids:
+            self._update_candidate_index(id)
+        stamp, estimates = self.clock.now()*100, self.failure_estimates.copy()
+        self.estimates_lock.release()
+        # A streamed log may write to disk, keep that out of the lock
+        if len(ids) > 0:
+            self.fail_est_logger.tick(stamp, estimates)
+        logging.info("[RECV][Gossip] ShareEstimatesMsg from: %s, merged nodes: %s", sender, ids)
 
-            # Parse data, construct message
-            message = parse_and_construct(data)
 
-            # If candidate accepts leader role
-            if isinstance(message, ConfirmElectionMessage):
-                self.receive_confirm_election_msg(message)
+    def send_broadcast(self):
+        """Send message in the out_buffer to other nodes"""
+        self.clock.run(self.broadcast_process())
 
-            # If we receive request from leader, send response
-            if isinstance(message, RequestBroadcastMessage):
-                self.receive_request_broadcast(message)
 
+    def broadcast_process(self):
+        """Flush the out_buffer whenever it is woken up, yields the wakeup"""
+        while self.run:
+            # if we are faulty, do not send anything
             if not self.is_failed:
+                # clear our out_buffer, newest message first
+                self.out_lock.acquire()
+                messages = self.out_queue[::-1]
+                self.out_queue = []
+                self.out_lock.release()
+                # Broadcast to all other nodes, one write per node
+                if len(messages) > 0:
+                    self.send_multicast(messages, self.peer_ports)
+            yield self.out_wakeup
+
+
+    def broadcast(self, message):
+        """Add message to the out_buffer and wake up the broadcaster"""
+        self.out_lock.acquire()
+        self.out_queue.append(message)
+        self.out_lock.release()
+        self.out_wakeup.set()
+
+
+    def handle_message(self, message):
+        """Dispatch a parsed message to its handler.
+
+        Args
+        ----
+            message (Message): received message
+        """
+        # If candidate accepts leader role
+        if isinstance(message, ConfirmElectionMessage):
+            self.receive_confirm_election_msg(message)
+
+        # If we receive request from leader, send response
+        if isinstance(message, RequestBroadcastMessage):
+            self.receive_request_broadcast(message)
+
+        if isinstance(message, HeartbeatMessage):
+            self.receive_heartbeat(message)
+
+        if not self.is_failed:
 
-                # If we receive ping message from any other node
-                if isinstance(message, PingMessage):
-                    self.receive_ping_message(message)
+            # If we receive ping message from any other node
+            if isinstance(message, PingMessage):
+                self.receive_ping_message(message)
 
-                # If we receive ping reply message from any other node
-                elif isinstance(message, PingReplyMessage):
-                    self.receive_ping_reply_message(message)
+            # If we receive ping reply message from any other node
+            elif isinstance(message, PingReplyMessage):
+                self.receive_ping_reply_message(message)
 
-                # if self.leader['id'] is not None:
+            # if self.leader['id'] is not None:
 
-                # If we receive request from client
-                # (either we are leader or leader is down!)
-                elif isinstance(message, ClientRequestMessage):
-                    self.receive_request(message)
+            # If we receive request from client
+            # (either we are leader or leader is down!)
+            elif isinstance(message, ClientRequestMessage):
+                self.receive_request(message)
 
-                # If we receive candidates from another node, update local candidate list
-                elif isinstance(message, ShareCandidatesMessage):
-                    self.receive_candidate_msg(message)
+            # If we receive candidates from another node, update local candidate list
+            elif isinstance(message, ShareCandidatesMessage):
+                self.receive_candidate_msg(message)
 
-                elif self.leader == self.id and isinstance(message, ReplyBroadcastMessage):
-                    self.receive_broadcast_reply(message)
+            # If we receive the estimates of another node, merge them
+            elif isinstance(message, ShareEstimatesMessage):
+                self.receive_estimates_msg(message)
 
-            # If the environement fails us!
-            if isinstance(message, FailureMessage):
-                self.receive_state_change_msg(message)
+            elif self.leader == self.id and isinstance(message, ReplyBroadcastMessage):
+                self.receive_broadcast_reply(message)
 
-        connection.close()
+        # If the environement fails us!
+        if isinstance(message, FailureMessage):
+            self.receive_state_change_msg(message)
 
 
     def receive_state_change_msg(self, message):
         """If our failure state changes"""
-        previous_fail_status = self.is_failed
         if message.failureVal == "True":
             if not self.is_failed:
                 self.update_failure_estimate_up(self.id)
-            lock.acquire()
+            self.lock.acquire()
             self.is_failed = True
-            lock.release()
+            self.lock.release()
         else:
             # if previous_fail_status == True:
             #     self.leader['id'] = None
-            lock.acquire()
+            self.lock.acquire()
             self.is_failed = False
-            lock.release()
-        logging.info("[Status] Failed Status: {}".format(self.is_failed))
+            self.lock.release()
+            # Send what was queued while we were failed
+            self.out_wakeup.set()
+        logging.info("[Status] Failed Status: %s", self.is_failed)
 
 
     def receive_request_broadcast(self, message):
         """Respond to request broadcast from leader if not failed."""
-        logging.info("[RECV] RequestBroadcastMsg ID: {} from: {}, msg: {}"
-                    .format(message.requestId, message.sender, message))
+        logging.info("[RECV] RequestBroadcastMsg ID: %s from: %s, msg: %s",
+                     message.requestId, message.sender, message)
         self.request_broadcast_id = None
         if self.leader['id'] != message.leader and \
                         self.leader['stamp'] < message.stamp:
-            lock.acquire()
+            self.lock.acquire()
             self.leader['id'] = int(message.leader)
             self.leader['stamp'] = message.stamp
-            lock.release()
-            logging.info("[Leader] Changed leader to {} @ {}".format(self.leader['id'], self.leader['stamp']))
+            self.lock.release()
+            logging.info("[Leader] Changed leader to %s @ %s", self.leader['id'], self.leader['stamp'])
 
-        lock.acquire()
-        self.message_buffer[message.sender][message.requestId] = 1
-        lock.release()
+        self.lock.acquire()
+        self.message_buffer[message.sender].add(message.requestId)
+        self.lock.release()
         if not self.is_failed:
             self.update_failure_estimate_down(message.sender)
-            logging.info("[SEND] [Message]ReplyBroadcastMsg to: {}".format(self.leader['id']))
-            response_msg = str(ReplyBroadcastMessage(self.id, self.leader['id'], 0, message.requestId))
+            logging.info("[SEND] [Message]ReplyBroadcastMsg to: %s", self.leader['id'])
+            response_msg = ReplyBroadcastMessage(self.id, self.leader['id'], 0, message.requestId)
             self.send_unicast(response_msg, self.ports[self.leader['id']])
 
         # Hack to shut down the node
         if message.requestId == self.num_reqests - 1:
-            time.sleep(5)
-            self.stop_node()
+            self.clock.call_later(5, self.stop_node)
 
 
     def receive_ping_message(self, message):
         """ Decreasing the failure probability of the node it received ping from"""
-        logging.info("[RECV][FailEst] [Message]PingMsg from: {} @ {}, msg: {}".format(message.sender, message.stamp, message))
+        logging.info("[RECV][FailEst] [Message]PingMsg from: %s @ %s, msg: %s", message.sender, message.stamp, message)
         self.update_failure_estimate_down(message.sender)
-        logging.info("[SEND][FailEst] [Message]PingReplyMsg to: {}".format(message.sender))
-        reply_message = str(PingReplyMessage(self.id, 0, time.time()*100))
+        logging.info("[SEND][FailEst] [Message]PingReplyMsg to: %s", message.sender)
+        reply_message = PingReplyMessage(self.id, 0, self.clock.now()*100)
         self.send_unicast(reply_message, self.ports[message.sender])
 
 
     def receive_broadcast_reply(self, message):
         """ Decreasing the failure probability of the node it received boradcast reply from"""
-        logging.info("[RECV] [Message]ReplyBroadcastMsg from: {} @ {}, msg: {}".format(message.sender, message.stamp, message))
+        logging.info("[RECV] [Message]ReplyBroadcastMsg from: %s @ %s, msg: %s", message.sender, message.stamp, message)
         self.update_failure_estimate_down(message.sender)
 
 
+    def start_election(self):
+        """Start a leader election with the configured algorithm"""
+        if self.election_algorithm == Election_Algorithm.DETERMINISITC:
+            logging.info("[LeaderElec] Starting Deterministic LE...")
+            self.leader_election_deterministic()
+        elif self.election_algorithm == Election_Algorithm.LEARNING:
+            logging.info("[LeaderElec] Starting Learning LE...")
+            self.leader_election_learning_based()
+        elif self.election_algorithm == Election_Algorithm.RANDOM:
+            logging.info("[LeaderElec] Starting Random LE...")
+            self.leader_election_randomized()
+
+
     def leader_election_learning_based(self):
         """Learning Leader Election"""
         self.update_failure_estimate_up(self.leader['id'])
+        # A retry, the last winner did not take over: vote again from scratch
+        self.lock.acquire()
+        tally = self.tallies.get(int(self.leader['id']))
+        if tally is not None:
+            tally.new_round()
+        self.lock.release()
         ids = self._select_node_exploitation(topn=int((self.total_nodes - 1) / 2))
-        logging.info("[LeaderElec] Candidates: {}".format(ids))
+        logging.info("[LeaderElec] Candidates: %s", ids)
         # add candidate message to out queue
-        lock.acquire()
-        msg = str(ShareCandidatesMessage(self.id, self.leader['id'], time.time()*100, list(ids)))
-        logging.info("[SEND][LeaderElec] [Message]ShareCandidatesMsg {}".format(msg))
-        self.out_queue.append(msg)
-        lock.release()
+        msg = ShareCandidatesMessage(self.id, self.leader['id'], self.clock.now()*100, list(ids))
+        logging.info("[SEND][LeaderElec] [Message]ShareCandidatesMsg %s", msg)
+        self.broadcast(msg)
+        self.count_votes(self.id, self.leader['id'], ids)
 
 
     def leader_election_deterministic(self):
         """Deterministic Leader Election"""
         next_candidate = (self.leader['id'] + 1)%self.total_nodes
-        logging.info("[LeaderElec] Candidate: {}".format(next_candidate))
+        logging.info("[LeaderElec] Candidate: %s", next_candidate)
         # if I am the next leader send the confirm election
         # TODO: Fix this line below!
+        # The stamp stays the one of the last confirmed leader until the
+        # candidate confirms, so we do not redirect clients to it
         self.leader['id'] = next_candidate
         if next_candidate == self.id and not self.is_failed:
-            self.leader['stamp'] = time.time() * 100
+            self.leader['stamp'] = int(self.clock.now() * 100)
             logging.info("[LeaderElec] I am next leader!")
             logging.info("[SEND][LeaderElec] ConfirmElectionMsg")
-            self.send_unicast(str(ConfirmElectionMessage(self.id, next_candidate, self.leader['stamp'])),
+            self.broadcast(ConfirmElectionMessage(self.id, next_candidate, self.leader['stamp']))
+            self.send_unicast(ConfirmElectionMessage(self.id, next_candidate, self.leader['stamp']),
                               self.client_port)
 
 
@@ -393,61 +676,65 @@ class v2(Node):
         # if I am supposed to select the next leader
         if next_candidate == self.id:
             logging.info("[LeaderElec] I am next leader!")
-            self.leader['id'] = self.rng.choice(self.total_nodes, size=1, replace=False)
+            self.leader['id'] = int(self.rng.choice(self.total_nodes))
 
-            logging.info("[LeaderElec] New leader: {}".format(self.leader['id']))
-            self.leader['stamp'] = time.time() * 100
+            logging.info("[LeaderElec] New leader: %s", self.leader['id'])
+            self.leader['stamp'] = int(self.clock.now() * 100)
 
-            lock.acquire()
             logging.info("[SEND][LeaderElec] ConfirmElectionMsg")
-            self.out_queue.append(str(ConfirmElectionMessage(self.id, self.leader['id'], self.leader['stamp'])))
-            lock.release()
+            self.broadcast(ConfirmElectionMessage(self.id, self.leader['id'], self.leader['stamp']))
 
             logging.info("[SEND][Client][LeaderElec] ConfirmElectionMsg")
-            self.send_unicast(str(ConfirmElectionMessage(self.id, self.leader['id'], self.leader['stamp'])),
+            self.send_unicast(ConfirmElectionMessage(self.id, self.leader['id'], self.leader['stamp']),
                               self.client_port)
 
 
     def receive_request(self, message):
         """Received from the client, if we are the leader, or the leader failed """
-        logging.info("[RECV][Client] Request ID: {}, message = {}"
-                     .format(message.requestId, message))
+        logging.info("[RECV][Client] Request ID: %s, message = %s",
+                     message.requestId, message)
 
         requestId = message.requestId
 
         if self.leader['id'] == self.id:
-            logging.info("[SEND][Client] ResponseMsg msg: {}".format(message))
-            self.send_unicast(str(ResponseMessage(self.id, self.leader['id'], time.time()*100, requestId)),
+            logging.info("[SEND][Client] ResponseMsg msg: %s", message)
+            self.send_unicast(ResponseMessage(self.id, self.leader['id'], self.clock.now()*100, requestId),
+                            self.client_port)
+            logging.info("[SEND][Client] RequestBroadcastMsg msg: %s", message)
+            self.broadcast(RequestBroadcastMessage(self.id, self.leader['id'], self.clock.now()*100, requestId))
+        elif self.leader['id'] != message.leader and self.leader['stamp'] > message.leaderStamp:
+            # The client does not know the current leader, point it there
+            # instead of starting an election
+            logging.info("[SEND][Client] RedirectMsg to leader %s @ %s", self.leader['id'], self.leader['stamp'])
+            self.send_unicast(RedirectMessage(self.id, self.leader['id'], self.leader['stamp'], requestId),
                             self.client_port)
-            lock.acquire()
-            logging.info("[SEND][Client] RequestBroadcastMsg msg: {}".format(message))
-            self.out_queue.append(str(RequestBroadcastMessage(self.id, self.leader['id'], time.time()*100, requestId)))
-            lock.release()
         elif requestId not in self.message_buffer[self.leader['id']]:
             # Function overloads for when a node is rejoining the node pool
             # When this happens, update the leader with the client leader and
             # take part in leader election.
-            # lock.acquire()
+            # self.lock.acquire()
             # self.leader['id'] = int(message.leader)
-            # lock.release()
-            if self.request_broadcast_id is not None and self.request_broadcast_id == requestId:
-                self.penalize()
+            # self.lock.release()
+            now = self.clock.now()
+            self.lock.acquire()
+            started = self.election_started
+            if self.heartbeat_sec > 0 and started is not None and started[0] == message.leader and \
+                    now - started[1] < self.election_timeout:
+                # We suspected the leader already and are electing a new one
+                self.lock.release()
+                logging.info("[LeaderElec] Election for leader %s already started", message.leader)
             else:
-                self.request_broadcast_id = requestId
-            if self.election_algorithm == Election_Algorithm.DETERMINISITC:
-                logging.info("[LeaderElec] Starting Deterministic LE...")
-                self.leader_election_deterministic()
-            elif self.election_algorithm == Election_Algorithm.LEARNING:
-                logging.info("[LeaderElec] Starting Learning LE...")
-                self.leader_election_learning_based()
-            elif self.election_algorithm == Election_Algorithm.RANDOM:
-                logging.info("[LeaderElec] Starting Random LE...")
-                self.leader_election_randomized()
+                self.election_started = (int(self.leader['id']), now)
+                self.lock.release()
+                if self.request_broadcast_id is not None and self.request_broadcast_id == requestId:
+                    self.penalize()
+                else:
+                    self.request_broadcast_id = requestId
+                self.start_election()
 
         # Hack to shut down the node
         if message.requestId == self.num_reqests - 1:
-            time.sleep(10)
-            self.stop_node()
+            self.clock.call_later(10, self.stop_node)
 
 
     def receive_confirm_election_msg(self, message):
@@ -458,99 +745,89 @@ class v2(Node):
         ----
             message (Message): Candidate
         """
-        logging.info("[RECV][LeaderElec] ConfirmElectionMsg from: {} @ {}, msg = {}"
-                     .format(message.sender, message.stamp, message))
+        logging.info("[RECV][LeaderElec] ConfirmElectionMsg from: %s @ %s, msg = %s",
+                     message.sender, message.stamp, message)
         if message.stamp > self.leader['stamp']:
-            lock.acquire()
+            self.lock.acquire()
             self.leader['id'] = int(message.leader)
             self.leader['stamp'] = message.stamp
-            lock.release()
-            logging.info("[Leader] Changed leader to {} @ {}".format(self.leader['id'], self.leader['stamp']))
-            # Clear out candidates now that we have a leader
-            lock.acquire()
-            self.candidates = []
+            self.lock.release()
+            logging.info("[Leader] Changed leader to %s @ %s", self.leader['id'], self.leader['stamp'])
+            # Clear out votes now that we have a leader
+            self.lock.acquire()
+            self.tallies = {}
             self.my_candidates = []
-            lock.release()
+            self.lock.release()
             if not self.is_failed:
                 self.update_failure_estimate_down(message.sender)
 
 
     def receive_messages(self):
-        """Listener that starts a new thread and reads messages from port"""
-        host = '127.0.0.1'
-        port = self.my_receving_port
-        receiving_socket = socket.socket()
-        try:
-            receiving_socket.bind((host, port))
-        except socket.error as e:
-            logging.error(str(e))
-        receiving_socket.listen(5)
-        while self.run:
-            Client, _ = receiving_socket.accept()
-            Client.settimeout(60)
-            start_new_thread(self.multi_threaded_client, (Client,))
+        """Listener that traces and handles the messages received on our port"""
+        self.transport.listen(self.my_receving_port, self.receive, self.on_listening)
 
 
     def receive_candidate_msg(self, message):
-        """On receiving candidates from nodes, update local candidate buffer.
-        If we have enough candidates, then update the leader. Update sender
-        failure prob.
-
-        Broadcast ConfirmElection if we are new leader and not failed.
+        """On receiving candidates from nodes, count their votes. Update
+        sender failure prob.
 
         Args
         ----
             Message (Message): CandidateElection message
         """
-        # if self.leader['id'] != message.leader and \
-        #     self.leader['stamp'] < message.stamp:
-        #     self.leader['id'] = message.leader
-        #     self.leader['stamp'] = message.stamp
-        #     logging.info("[Leader] Changed leader to {} @ {}".format(self.leader['id'], self.leader['stamp']))
-
-        lock.acquire()
-        self.candidates.append(message.candidates)
-        lock.release()
         self.update_failure_estimate_down(message.sender)
-        logging.info("[RECV][LeaderElec] ShareCandidatesMsg from: {}, msg: {}"
-                     .format(message.sender, message))
-
-        # If we have enough candidates to decide on leader
-        if len(self.candidates) > int((self.total_nodes - 1) / 2 - 1) and \
-                len(self.my_candidates) > 0:
-            time.sleep(3)
-
-            lock.acquire()
-            self.candidates.append(self.my_candidates)
-            local_candidates = self.candidates
-            self.candidates = []
-            lock.release()
-            candidate_np = np.array(local_candidates).flatten()
-            #self.leader['id'] = np.argmax(np.bincount(candidate_np))
-            leader_id = np.argsort(np.bincount(candidate_np))[-1]
-            lock.acquire()
-            if leader_id != self.leader['id']:
-                self.local_leader = leader_id
-            else:
-                self.local_leader = np.argsort(np.bincount(candidate_np))[-2]
-            lock.release()
-            logging.info("[LeaderElec] Got enough ShareCandidatesMsg's, New leader: {}".format(self.local_leader))
-            self.send_unicast(str(NewLeaderMessage(self.id, self.local_leader, time.time() * 100)),
-                              self.client_port)
+        logging.info("[RECV][LeaderElec] ShareCandidatesMsg from: %s, msg: %s",
+                     message.sender, message)
+        self.count_votes(message.sender, message.leader, message.candidates)
 
-            # If we are the leader, broadcast candidate acceptance if we
-            # are not failed
-            if self.local_leader == self.id and not self.is_failed:
-                lock.acquire()
-                self.leader['stamp'] = time.time() * 100
-                self.leader['id'] = self.local_leader
-                lock.release()
-                logging.info("[LeaderElec] I am the new leader! Broadcasting ConfirmElectionMsg")
-                lock.acquire()
-                self.out_queue.append(str(ConfirmElectionMessage(self.id, self.leader['id'], self.leader['stamp'])))
-                lock.release()
-                self.send_unicast(str(ConfirmElectionMessage(self.id, self.leader['id'], self.leader['stamp'])),
-                                  self.client_port)
+
+    def count_votes(self, voter, replaced, candidates):
+        """Add the candidates of voter to the votes for the node replacing
+        leader replaced.
+
+        Once a majority voted (including us), the node with the most votes
+        is the new leader, the lowest id on ties. Votes arriving later can
+        still change it, so that all nodes end up with the same leader.
+        Votes to replace a leader other than ours are late, and ignored.
+        """
+        if int(replaced) != int(self.leader['id']):
+            logging.info("[LeaderElec] Ignoring votes of %s to replace %s, leader is %s",
+                         voter, replaced, self.leader['id'])
+            return
+        self.lock.acquire()
+        tally = self.tallies.get(int(replaced))
+        if tally is None:
+            tally = self.tallies[int(replaced)] = VoteTally(self.total_nodes, replaced)
+        tally.vote(voter, candidates)
+        winner = tally.decide(self.quorum) if self.id in tally.ballots else None
+        if winner is None:
+            self.lock.release()
+            return
+        self.local_leader = winner
+        self.lock.release()
+        self.decide_leader()
+
+
+    def decide_leader(self):
+        """Announce the new leader (local_leader) to the client.
+
+        Broadcast ConfirmElection if we are new leader and not failed.
+        """
+        logging.info("[LeaderElec] Got enough ShareCandidatesMsg's, New leader: %s", self.local_leader)
+        self.send_unicast(NewLeaderMessage(self.id, self.local_leader, self.clock.now() * 100),
+                          self.client_port)
+
+        # If we are the leader, broadcast candidate acceptance if we
+        # are not failed
+        if self.local_leader == self.id and not self.is_failed:
+            self.lock.acquire()
+            self.leader['stamp'] = int(self.clock.now() * 100)
+            self.leader['id'] = self.local_leader
+            self.lock.release()
+            logging.info("[LeaderElec] I am the new leader! Broadcasting ConfirmElectionMsg")
+            self.broadcast(ConfirmElectionMessage(self.id, self.leader['id'], self.leader['stamp']))
+            self.send_unicast(ConfirmElectionMessage(self.id, self.leader['id'], self.leader['stamp']),
+                              self.client_port)
 
 
     def update_failure_estimate_down(self, id: int):
@@ -561,13 +838,23 @@ class v2(Node):
         ----
             id (int): Node ID to update.
         """
+        self.estimates_lock.acquire()
         self.arm_counts[int(id)] += 1
-        self.failure_estimates[id] = \
-            (self.failure_estimates[id] * self.node_count[id]) / (self.node_count[id] + 1)
+        if self.estimator is None:
+            self.failure_estimates[id] = \
+                (self.failure_estimates[id] * self.node_count[id]) / (self.node_count[id] + 1)
+        else:
+            self.failure_estimates[id] = self.estimator.update(id, 0)
         self.node_count[id] += 1
+        self.own_counts[id] += 1
         self.t += 1
-        self.fail_est_logger.tick(time.time()*100, self.failure_estimates)
-        logging.info("[FailEst DOWN] Updating Node: {} New FailEst: {}".format(id, self.failure_estimates))
+        self.posterior.update(id, False)
+        self._update_candidate_index(id)
+        stamp, estimates = self.clock.now()*100, self.failure_estimates.copy()
+        self.estimates_lock.release()
+        # A streamed log may write to disk, keep that out of the lock
+        self.fail_est_logger.tick(stamp, estimates)
+        logging.info("[FailEst DOWN] Updating Node: %s New FailEst: %s", id, estimates)
 
 
     def update_failure_estimate_up(self, id: int):
@@ -577,33 +864,66 @@ class v2(Node):
         ----
             id (int): Node ID to update.
         """
+        self.estimates_lock.acquire()
         self.arm_counts[int(id)] += 1
-        self.failure_estimates[id] = \
-            (self.failure_estimates[id] * self.node_count[id] + 1) / (self.node_count[id] + 1)
+        if self.estimator is None:
+            self.failure_estimates[id] = \
+                (self.failure_estimates[id] * self.node_count[id] + 1) / (self.node_count[id] + 1)
+        else:
+            self.failure_estimates[id] = self.estimator.update(id, 1)
         self.node_count[id] += 1
+        self.own_counts[id] += 1
+        self.own_failures[id] += 1
         self.t += 1
-        self.fail_est_logger.tick(time.time()*100, self.failure_estimates)
-        logging.info("[FailEst UP] Updating Node: {} New FailEst: {}".format(id, self.failure_estimates))
+        self.posterior.update(id, True)
+        self._update_candidate_index(id)
+        stamp, estimates = self.clock.now()*100, self.failure_estimates.copy()
+        self.estimates_lock.release()
+        # A streamed log may write to disk, keep that out of the lock
+        self.fail_est_logger.tick(stamp, estimates)
+        logging.info("[FailEst UP] Updating Node: %s New FailEst: %s", id, estimates)
 
 
     def run_node(self):
         """Run threads to send and receive messages"""
         self.run = True
-        logging.info("[Status] Starting Node: {}".format(self.id))
-        logging.info("[FailEst] Init. FailureEst: {}".format(self.failure_estimates))
+        logging.info("[Status] Starting Node: %s", self.id)
+        logging.info("[FailEst] Init. FailureEst: %s", self.failure_estimates)
         receive = threading.Thread(target=self.receive_messages)
         receive.start()
         send_message = threading.Thread(target=self.send_broadcast)
         send_message.start()
         send_ping = threading.Thread(target=self.send_ping_message)
         send_ping.start()
+        send_heartbeat = threading.Thread(target=self.send_heartbeats)
+        send_heartbeat.start()
+        send_gossip = threading.Thread(target=self.send_gossip)
+        send_gossip.start()
+
+
+    def start(self):
+        """Start listening and the processes on an event-driven clock
+        (simulator, asyncio) without blocking."""
+        self.run = True
+        logging.info("[Status] Starting Node: %s", self.id)
+        logging.info("[FailEst] Init. FailureEst: %s", self.failure_estimates)
+        self.receive_messages()
+        self.clock.run(self.broadcast_process())
+        self.clock.run(self.ping_process())
+        self.clock.run(self.heartbeat_process())
+        self.clock.run(self.gossip_process())
 
 
     def stop_node(self):
         """Terminate all threads of the node."""
-        logging.info("[Status] Stopping Node: {}".format(self.id))
-        lock.acquire()
+        logging.info("[Status] Stopping Node: %s", self.id)
+        self.lock.acquire()
         self.run = False
-        lock.release()
+        self.lock.release()
+        self.out_wakeup.set()
         make_dirs(join(self.exp_name))
         self.fail_est_logger.save(join(self.exp_name, 'failEst_{}.pbz2'.format(self.id)))
+        if self.trace is not None:
+            self.trace.close()
+        if self.on_stopped is not None:
+            self.on_stopped()
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class RequestWindow():
+    def __init__(self, size=1024):
+        """Set of the request IDs seen, with bounded memory.
+
+        IDs below the watermark low were all seen, the ones in
+        [low, low + size) are kept in a ring of bits. The watermark moves up
+        as soon as the ID at it is seen, so add and lookup are O(1) while
+        requests arrive roughly in order. An ID more than size above the
+        watermark moves it up, the unseen IDs it passes count as seen.
+
+            size: number of IDs above the watermark kept
+        """
+        self.size = size
+        self.low = 0
+        self.bits = np.zeros(size, dtype=bool)
+
+    def add(self, id):
+        """Mark request id as seen"""
+        id = int(id)
+        if id < self.low:
+            return
+        if id >= self.low + self.size:
+            # Drop the IDs that no longer fit in the ring
+            new_low = id - self.size + 1
+            if new_low - self.low >= self.size:
+                self.bits[:] = False
+            else:
+                for k in range(self.low, new_low):
+                    self.bits[k % self.size] = False
+            self.low = new_low
+        self.bits[id % self.size] = True
+        while self.bits[self.low % self.size]:
+            # Move the watermark before clearing, lookups see one of them
+            self.low += 1
+            self.bits[(self.low - 1) % self.size] = False
+
+    def __contains__(self, id):
+        id = int(id)
+        return id < self.low or (id < self.low + self.size and bool(self.bits[id % self.size]))
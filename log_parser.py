@@ -1,42 +1,41 @@
-import glob, os
-from collections import Counter
-os.chdir("logs")
-
-
-def print_message_freq(file):
-    print("Printing for file : ", file)
-    message_dict_send = Counter()
-    message_dict_recv = Counter()
-    with open(file) as f:
-        lines = f.readlines()
-        for line in lines:
-            if len(line.split("()")) > 1:
-                line = line.split("()")[1]
-            else:
-                continue
-
-            if "[RECV]" in line:
-                words = line.split(" ")
-                for word in words:
-                    if word.startswith("[Message]"):
-                        message_dict_recv[word[9:]] += 1
-
-            elif "[SEND]" in line:
-                print(line)
-                words = line.split(" ")
-                for word in words:
-                    if word.startswith("[Message]"):
-                        message_dict_send[word[9:]] += 1
-
-
-    print("###### SEND STATS #######")
-    for key in message_dict_send:
-        print(key, "\t", message_dict_send[key])
-
-    print("###### RECV STATS #######")
-    for key in message_dict_recv:
-        print(key, "\t", message_dict_recv[key])
-    print("\n\n")
-
-for file in glob.glob("*.log"):
-    print_message_freq(file)
\ No newline at end of file
+import argparse
+import numpy as np
+
+from utils.logger import TRACE_EVENTS, load_trace
+
+
+def component_name(node):
+    if node == -1:
+        return "client"
+    if node == -2:
+        return "env"
+    return "node_{}".format(node)
+
+
+def print_message_freq(events, messages):
+    """Number of messages sent and received per component and message type"""
+    for node in np.unique(events['node']):
+        print("Printing for : ", component_name(node))
+        node_events = events[events['node'] == node]
+        for event, name in enumerate(TRACE_EVENTS):
+            print("###### {} STATS #######".format(name))
+            types, counts = np.unique(node_events['message'][node_events['event'] == event],
+                                      return_counts=True)
+            for message, count in zip(types, counts):
+                print(messages[message], "\t", count)
+        print("\n\n")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Message statistics of the event traces of a run')
+    parser.add_argument(
+        '-e',
+        '--exp_name',
+        type=str,
+        help='Name of experiment (run with log.trace: True)'
+    )
+    args = parser.parse_args()
+
+    events, meta = load_trace(args.exp_name)
+    print_message_freq(events, meta.get('messages', []))
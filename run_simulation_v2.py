@@ -2,15 +2,26 @@ import argparse
 import yaml
 from easydict import EasyDict
 
+import os
 import time
 
 # from learning.environment import Environment
 from learning.environment_v2 import Environmentv2 as Environment
 from learning.v2 import v2 as Node
 from learning.client import Client
+from learning.simulator import simulate_cluster
+from learning.transport import LoopbackTransport
+from learning.async_runtime import AsyncioRuntime
 
 global nodes, message_buffer
 
+
+def signal_ready(fd):
+    """Tell the launcher through the pipe fd that we are listening"""
+    os.write(fd, b'ready\n')
+    os.close(fd)
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Simulate Leader Election')
@@ -22,7 +33,7 @@ if __name__ == "__main__":
     parser.add_argument(
         '-t',
         '--type',
-        help='<env|node_id|client>'
+        help='<env|node_id|client|sim|local>'
     )
     parser.add_argument(
         '-d',
@@ -37,26 +48,97 @@ if __name__ == "__main__":
         type=str,
         help='Name of experiment'
     )
+    parser.add_argument(
+        '--base_port',
+        type=int,
+        default=None,
+        help='Override port.replica_base_port of the config'
+    )
+    parser.add_argument(
+        '--client_port',
+        type=int,
+        default=None,
+        help='Override port.client_port of the config'
+    )
+    parser.add_argument(
+        '--ready_fd',
+        type=int,
+        default=None,
+        help='Pipe to write to once the node is listening (see launch.py)'
+    )
     args = parser.parse_args()
 
     with open(args.config) as f:
         config = yaml.safe_load(f)
     config = EasyDict(config)
+    if args.base_port is not None:
+        config.port.replica_base_port = args.base_port
+    if args.client_port is not None:
+        config.port.client_port = args.client_port
+
+    # Node/client runtime: threaded (default) or asyncio
+    use_asyncio = config.get('runtime', 'threaded') == 'asyncio'
 
     type = args.type
     if type == 'env':
         env = Environment(config.num_nodes, config, args.exp_name)
         env.run_threads()
+        # Save the failures on Ctrl-C (or SIGINT from launch.py)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            env.stop_threads()
+            env.save()
         # time.sleep(args.duration)
         # env.stop_threads()
 
     elif type.startswith('node'):
         node_id = type.split("_")[1]
-        node = Node(int(node_id), config.num_nodes, config, args.exp_name)
-        node.run_node()
+        if use_asyncio:
+            runtime = AsyncioRuntime()
+            node = Node(int(node_id), config.num_nodes, config, args.exp_name,
+                        clock=runtime, transport=runtime)
+        else:
+            node = Node(int(node_id), config.num_nodes, config, args.exp_name)
+        if args.ready_fd is not None:
+            node.on_listening = lambda: signal_ready(args.ready_fd)
+        if use_asyncio:
+            node.on_stopped = runtime.close
+            node.start()
+            runtime.serve_forever()
+            runtime.shutdown()
+        else:
+            node.run_node()
         # time.sleep(args.duration)
         # node.stop_node()
 
     elif type == 'client':
-        client = Client(-1, config.num_nodes, config, args.exp_name)
+        if use_asyncio:
+            runtime = AsyncioRuntime()
+            client = Client(-1, config.num_nodes, config, args.exp_name,
+                            clock=runtime, transport=runtime)
+            runtime.run_until_complete(client.start())
+            runtime.shutdown()
+        else:
+            client = Client(-1, config.num_nodes, config, args.exp_name)
+            client.run_node()
+
+    elif type == 'sim':
+        # Run env, nodes and client in this process on virtual time
+        simulate_cluster(config, args.exp_name)
+
+    elif type == 'local':
+        # Run env, nodes and client in this process over an in-memory transport
+        transport = LoopbackTransport()
+        nodes = [Node(i, config.num_nodes, config, args.exp_name, transport=transport)
+                 for i in range(config.num_nodes)]
+        for node in nodes:
+            node.run_node()
+        env = Environment(config.num_nodes, config, args.exp_name, transport=transport)
+        env.run_threads()
+        client = Client(-1, config.num_nodes, config, args.exp_name, transport=transport)
         client.run_node()
+        env.stop_threads()
+        env.save()
+        transport.close()
@@ -1,47 +1,256 @@
+import argparse
+import math
+import yaml
+from easydict import EasyDict
+
 import numpy as np
-import threading
-import time
-from sklearn.model_selection import train_test_split
-
-max_failed_nodes = 3
-total_nodes = 3*max_failed_nodes + 1
-nodes = np.zeros(shape=total_nodes)
-view_changes = 0
-current_leader = 0
-run = True
-lock = threading.Lock()
-
-def select_leader():
-    global current_leader
-    global view_changes
-    global run
-    while run:
-        if nodes[current_leader] == 1:
-            current_leader = (current_leader + 1)%total_nodes
-            view_changes = view_changes + 1
-
-def fail_nodes():
-    while run:
-        all_nodes = np.arange(total_nodes)
-        lock.acquire()
-        not_failed, failed = train_test_split(all_nodes, test_size=max_failed_nodes)
-        for i in range(total_nodes):
-            if i in failed:
-                nodes[i] = 1
+from numpy.random import default_rng
+
+POLICIES = ['Deterministic', 'Randomized', 'Learning', 'Oracle']
+
+
+class FailureMonteCarlo():
+    def __init__(self, config, trials=1000, seed=None):
+        """Batched Monte Carlo simulation of the Environmentv2 failure process.
+
+        Evolves many independent clusters (trials) at once as [trials, nodes]
+        arrays: every fail_nodes_update seconds nodes fail as in
+        Environmentv2.fail_nodes (at least min_fail_fraction and at most
+        max_failed_nodes down) and are repaired after a lognormal repair
+        time. Next to the environment, each election policy keeps its own
+        leader per trial, which is lost when it fails and re-elected among
+        the alive nodes.
+
+            config: config parameters (same as run_simulation_v2.py)
+            trials: number of independent clusters
+            seed: random seed (default: config.random_seed)
+        """
+        n = config.num_nodes
+        self.trials = trials
+        self.total_nodes = n
+        self.rng = default_rng(config.random_seed if seed is None else seed)
+        self.max_failed_nodes = int((n - 1)/2)
+        self.min_failed_nodes = config.min_fail_fraction*self.max_failed_nodes
+        self.fail_nodes_update = config.fail_nodes_update
+
+        # Machine type and failure probability of every node in every trial
+        cluster = config.cluster_configuration
+        machine_dist = np.array(cluster.num_nodes, dtype=float)
+        machine_dist /= np.sum(machine_dist)
+        self.machine_types = self.rng.choice(len(machine_dist), size=(trials, n), p=machine_dist)
+        self.failure_probability = np.array(cluster.base)[self.machine_types]*cluster.scaling_constant
+        # Environmentv2.set_probability swaps the first two nodes
+        self.failure_probability[:, [0, 1]] = self.failure_probability[:, [1, 0]]
+
+        self.repair_time_mean = cluster.repair_time_mean
+        self.repair_time_sigma = cluster.repair_time_stdev
+        self.repair_scale_factor = cluster.scaling_repair_time_constant
+
+        # MAB parameters of the learning policy
+        self.epsilon = config.mab.epsilon
+        self.decay = config.mab.decay
+        self.estimates_init = config.failure_estimates
+
+    def sample_failures(self, alive):
+        """Sample the alive nodes to fail in one round of every trial.
+
+        Batched version of environment.sample_failures: one Bernoulli draw
+        per node, the missing failures are topped up by weighted sampling
+        without replacement (smallest exponential keys scaled by 1/p) and a
+        uniform subset is kept if more than max_failed_nodes are down.
+
+        Args
+        ----
+            alive (np.ndarray): [trials, nodes] boolean mask of alive nodes
+
+        Returns
+        -------
+            failed (np.ndarray): [trials, nodes] boolean mask of new failures
+        """
+        p = self.failure_probability
+        down = self.total_nodes - np.count_nonzero(alive, axis=1)
+        active = down < self.min_failed_nodes
+        failed = alive & active[:, None] & (self.rng.random(p.shape) < p)
+
+        # Top up to min_failed_nodes, nodes with p = 0 are taken last
+        missing = math.ceil(self.min_failed_nodes) - down - np.count_nonzero(failed, axis=1)
+        candidates = alive & ~failed & (active & (missing > 0))[:, None]
+        with np.errstate(divide='ignore'):
+            keys = np.where(p > 0, self.rng.exponential(size=p.shape)/p, np.inf)
+        ties = np.where(candidates, self.rng.random(p.shape), 2)
+        keys[~candidates] = np.inf
+        rank = np.lexsort((ties, keys), axis=-1).argsort(axis=-1)
+        failed |= candidates & (rank < missing[:, None])
+
+        # Random sample to limit nodes failed to max_failed_nodes
+        allowed = self.max_failed_nodes - down
+        keys = np.where(failed, self.rng.random(p.shape), 2)
+        rank = keys.argsort(axis=-1).argsort(axis=-1)
+        return failed & (rank < allowed[:, None])
+
+    def sample_repair(self, shape):
+        """Repair durations as in Environmentv2.sleep_for_repair"""
+        repair_duration = self.rng.lognormal(self.repair_time_mean, self.repair_time_sigma, shape)
+        repair_duration *= self.repair_scale_factor
+        return np.clip(repair_duration, 7, 30)
+
+    def elect(self, policy, state, lost, alive):
+        """Re-elect the leader of every trial in lost among the alive nodes.
+
+        Candidates are proposed until an alive one is found, every proposal
+        is one leader election round.
+
+        Returns
+        -------
+            rounds (np.ndarray): [trials] number of election rounds
+        """
+        n = self.total_nodes
+        rows = np.arange(self.trials)
+        leader = state['leader']
+        cursor = leader.copy()
+        tried = np.zeros((self.trials, n), dtype=bool)
+        tried[rows, leader] = True
+        rounds = np.zeros(self.trials, dtype=int)
+        electing = lost.copy()
+        for _ in range(n):
+            if not electing.any():
+                break
+            if policy == 'Deterministic':
+                cursor = (cursor + 1) % n
+                candidate = cursor
+            elif policy == 'Randomized':
+                candidate = self.rng.integers(n, size=self.trials)
+            elif policy == 'Learning':
+                explore = self.rng.random(self.trials) < state['epsilon']
+                candidate = np.where(
+                    explore,
+                    self.rng.integers(n, size=self.trials),
+                    np.where(tried, np.inf, state['estimates']).argmin(axis=1)
+                )
+                state['epsilon'] = np.where(electing, state['epsilon']*self.decay, state['epsilon'])
             else:
-                nodes[i] = 0
-        lock.release()
-        time.sleep(2)
+                candidate = np.where(alive, self.failure_probability, np.inf).argmin(axis=1)
 
+            rounds += electing
+            ok = alive[rows, candidate]
+            if policy == 'Learning':
+                self.update_estimates(state, electing & ~ok, candidate, 1)
+            leader[electing & ok] = candidate[electing & ok]
+            tried[rows, candidate] = True
+            electing &= ~ok
+        return rounds
 
-if __name__ == "__main__":
-    generate_failure = threading.Thread(target=fail_nodes, daemon=True)
-    generate_failure.start()
-    leader_election = threading.Thread(target=select_leader, daemon=True)
-    leader_election.start()
-    time.sleep(30)
-    run = False
-    print(view_changes)
+    def update_estimates(self, state, mask, ids, value):
+        """Running mean update of the failure estimates of ids where mask"""
+        rows = np.flatnonzero(mask)
+        ids = ids[rows]
+        count = state['counts'][rows, ids]
+        state['estimates'][rows, ids] = (state['estimates'][rows, ids]*count + value)/(count + 1)
+        state['counts'][rows, ids] += 1
+
+    def run(self, rounds, policies=POLICIES):
+        """Simulate rounds failure rounds of every trial.
 
+        Returns
+        -------
+            results (dict): expected failures per round, node downtime and
+                per policy the leader loss rate and election rounds per loss
+        """
+        n = self.total_nodes
+        rows = np.arange(self.trials)
+        horizon = rounds*self.fail_nodes_update
+        down_until = np.zeros((self.trials, n))
+        downtime = np.zeros((self.trials, n))
+        failures = np.zeros(self.trials)
+
+        states = {}
+        for policy in policies:
+            states[policy] = {
+                'leader': np.zeros(self.trials, dtype=int),
+                'losses': np.zeros(self.trials),
+                'rounds': np.zeros(self.trials),
+                'epsilon': np.full(self.trials, self.epsilon),
+                'estimates': self.rng.normal(
+                    self.estimates_init.mean, self.estimates_init.std, (self.trials, n)),
+                'counts': np.ones((self.trials, n))
+            }
+
+        for r in range(rounds):
+            t = r*self.fail_nodes_update
+            failed = self.sample_failures(down_until <= t)
+            repair = self.sample_repair((self.trials, n))
+            down_until = np.where(failed, t + repair, down_until)
+            downtime += np.where(failed, np.minimum(repair, horizon - t), 0)
+            failures += np.count_nonzero(failed, axis=1)
+            alive = down_until <= t
+
+            for policy, state in states.items():
+                lost = failed[rows, state['leader']]
+                state['losses'] += lost
+                if policy == 'Learning':
+                    self.update_estimates(state, lost, state['leader'], 1)
+                state['rounds'] += self.elect(policy, state, lost, alive)
+                if policy == 'Learning':
+                    # Alive nodes answer the broadcasts of the round
+                    count = state['counts']
+                    state['estimates'] = np.where(alive, state['estimates']*count/(count + 1), state['estimates'])
+                    state['counts'] = count + alive
+
+        results = {
+            'failures_per_round': np.mean(failures)/rounds,
+            'downtime': np.mean(downtime)/horizon,
+            'downtime_per_type': {
+                int(k): np.mean(downtime[self.machine_types == k])/horizon
+                for k in np.unique(self.machine_types)
+            }
+        }
+        for policy, state in states.items():
+            losses = np.sum(state['losses'])
+            results[policy] = {
+                'leader_loss_rate': losses/(self.trials*rounds),
+                'election_rounds_per_loss': np.sum(state['rounds'])/losses if losses else 0.0
+            }
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of node failures')
+    parser.add_argument(
+        '-c',
+        '--config',
+        help='Path to config file'
+        )
+    parser.add_argument(
+        '-n',
+        '--trials',
+        type=int,
+        default=1000,
+        help='Number of independent clusters'
+    )
+    parser.add_argument(
+        '-r',
+        '--rounds',
+        type=int,
+        default=1000,
+        help='Number of failure rounds (fail_nodes_update apart)'
+    )
+    parser.add_argument(
+        '-s',
+        '--seed',
+        type=int,
+        default=None,
+        help='Random seed (default: config random_seed)'
+    )
+    args = parser.parse_args()
 
+    with open(args.config, 'r') as f:
+        config = EasyDict(yaml.safe_load(f))
 
+    results = FailureMonteCarlo(config, args.trials, args.seed).run(args.rounds)
+    print("Failures per round : {:.3f}".format(results['failures_per_round']))
+    print("Node downtime      : {:.3f}".format(results['downtime']))
+    for k, v in results['downtime_per_type'].items():
+        print("  machine type {}   : {:.3f}".format(k, v))
+    for policy in POLICIES:
+        print("{:<14} leader loss rate: {:.3f}, election rounds per loss: {:.2f}".format(
+            policy, results[policy]['leader_loss_rate'], results[policy]['election_rounds_per_loss']))
@@ -0,0 +1,30 @@
+import socket
+
+from learning.async_runtime import AsyncioRuntime
+from learning.message import PingMessage
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_send_reports_connect_outcome():
+    runtime = AsyncioRuntime()
+    up, down = free_port(), free_port()
+    received = []
+    results = []
+    runtime.listen(up, received.append, lambda: runtime.call_later(0, sends))
+
+    def sends():
+        results.append(runtime.send(PingMessage(1, 0, 5), down))
+        results.append(runtime.send(PingMessage(1, 0, 6), up))
+        runtime.multicast([PingMessage(1, 0, 7)], [down, up])
+        runtime.call_later(0.2, runtime.close)
+
+    runtime.call_later(5, runtime.close)
+    runtime.serve_forever()
+    runtime.shutdown()
+    assert results == [False, True]
+    assert [message.stamp for message in received] == [6, 7]
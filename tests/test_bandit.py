@@ -0,0 +1,92 @@
+import numpy as np
+
+from learning.bandit import DiscountedMean, TopKIndex, WindowMean
+
+
+def test_smallest_ranks_lowest_first():
+    index = TopKIndex(np.array([0.5, 0.1, 0.9, 0.3]))
+    assert index.smallest(3).tolist() == [1, 3, 0]
+    assert index.smallest(10).tolist() == [1, 3, 0, 2]
+
+
+def test_smallest_skips_stale_entries():
+    index = TopKIndex(np.array([0.5, 0.1, 0.9, 0.3]))
+    # The old entries of arm 1 (0.1) and arm 3 (0.3) stay in the heap
+    index.update(1, 0.95)
+    index.update(3, 0.2)
+    index.update(3, 0.8)
+    assert index.smallest(2).tolist() == [0, 3]
+    assert index.smallest(4).tolist() == [0, 3, 2, 1]
+    # smallest does not consume the valid entries
+    assert index.smallest(1).tolist() == [0]
+
+
+def test_nan_scores_rank_last():
+    index = TopKIndex(np.array([np.nan, 0.2, 0.1]))
+    assert index.smallest(3).tolist() == [2, 1, 0]
+    index.update(2, np.nan)
+    assert index.smallest(2).tolist() == [1, 0]
+
+
+def test_matches_sort_after_many_updates():
+    rng = np.random.default_rng(0)
+    scores = rng.random(20)
+    index = TopKIndex(scores)
+    for _ in range(1000):
+        arm = rng.integers(20)
+        scores[arm] = rng.random()
+        index.update(arm, scores[arm])
+        # Rebuilds once invalidated entries dominate, heap stays bounded
+        assert len(index.heap) <= 4*len(scores) + 1
+    assert index.smallest(5).tolist() == np.argsort(scores)[:5].tolist()
+
+
+def observe_step(estimator, rng, before=0.1, after=0.9, steps=2000):
+    """Observe arm 0 failing at rate before, then after, interleaved with arm
+    1 failing at rate 0.5. Returns the estimates of arm 0 before the change,
+    and after, steps/2 observations each"""
+    estimates = []
+    for rate in (before, after):
+        for _ in range(steps//2):
+            estimate = estimator.update(0, float(rng.random() < rate))
+            estimator.update(1, float(rng.random() < 0.5))
+        estimates.append(estimate)
+    return estimates
+
+
+def test_discounted_mean_tracks_step_change():
+    rng = np.random.default_rng(0)
+    estimator = DiscountedMean(np.array([0.5, 0.5]), gamma=0.99)
+    before, after = observe_step(estimator, rng)
+    assert abs(before - 0.1) < 0.15
+    assert abs(after - 0.9) < 0.15
+    # About memory observations of all arms are remembered
+    assert abs(estimator.horizon() - 100) < 1
+    np.testing.assert_allclose(estimator.counts(), [50, 50], rtol=0.05)
+
+
+def test_discounted_mean_forgets_old_failures():
+    estimator = DiscountedMean(np.array([0.5]), gamma=0.9)
+    for _ in range(100):
+        estimator.update(0, 1)
+    for _ in range(100):
+        estimate = estimator.update(0, 0)
+    assert estimate < 0.001
+
+
+def test_window_mean_tracks_step_change():
+    rng = np.random.default_rng(1)
+    estimator = WindowMean(np.array([0.5, 0.5]), window=100)
+    before, after = observe_step(estimator, rng)
+    assert abs(before - 0.1) < 0.1
+    assert abs(after - 0.9) < 0.1
+    assert estimator.counts().tolist() == [100, 100]
+
+
+def test_window_mean_is_exact_over_the_window():
+    estimator = WindowMean(np.array([0.3]), window=4)
+    assert estimator.estimates[0] == 0.3
+    for value in [1, 1, 1, 1, 0, 0, 1]:
+        estimate = estimator.update(0, value)
+    # Last 4 observations: 1, 0, 0, 1
+    assert estimate == 0.5
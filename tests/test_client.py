@@ -0,0 +1,74 @@
+import pytest
+
+from learning.client import LeaderCache, RttEstimator
+
+
+def test_next_newest_hint():
+    cache = LeaderCache()
+    cache.add(2, 100)
+    cache.add(5, 300)
+    cache.add(3, 200)
+    assert cache.next(set(), 0) == {'id': 5, 'stamp': 300}
+
+
+def test_next_skips_tried_and_older():
+    cache = LeaderCache()
+    cache.add(2, 100)
+    cache.add(5, 300)
+    cache.add(3, 200)
+    assert cache.next({5}, 0) == {'id': 3, 'stamp': 200}
+    assert cache.next({5}, 200) is None
+    assert cache.next({5, 3}, 50) == {'id': 2, 'stamp': 100}
+    assert cache.next({2, 3, 5}, 0) is None
+
+
+def test_add_keeps_newest_stamp():
+    cache = LeaderCache()
+    cache.add(2, 300)
+    cache.add(2, 100)
+    assert cache.next(set(), 0) == {'id': 2, 'stamp': 300}
+
+
+def test_full_drops_oldest():
+    cache = LeaderCache(size=2)
+    cache.add(1, 100)
+    cache.add(2, 300)
+    cache.add(3, 200)
+    assert sorted(cache.hints) == [2, 3]
+    assert cache.next({2, 3}, 0) is None
+
+
+def test_rtt_first_sample():
+    rtt = RttEstimator(6, 0.2)
+    assert rtt.timeout == 6
+    rtt.sample(0.5)
+    # srtt + 4*rttvar = 0.5 + 4*0.25
+    assert rtt.srtt == 0.5 and rtt.rttvar == 0.25
+    assert rtt.timeout == pytest.approx(1.5)
+
+
+def test_rtt_smoothing():
+    rtt = RttEstimator(6, 0.2)
+    rtt.sample(0.5)
+    rtt.sample(1.5)
+    assert rtt.rttvar == pytest.approx(0.75*0.25 + 0.25*1.0)
+    assert rtt.srtt == pytest.approx(0.875*0.5 + 0.125*1.5)
+    assert rtt.timeout == pytest.approx(rtt.srtt + 4*rtt.rttvar)
+
+
+def test_rtt_converges_to_min_timeout():
+    rtt = RttEstimator(6, 0.2)
+    for _ in range(100):
+        rtt.sample(0.01)
+    assert rtt.srtt == pytest.approx(0.01, rel=0.01)
+    assert rtt.timeout == 0.2
+
+
+def test_rtt_clamped_to_initial():
+    rtt = RttEstimator(2, 0.2)
+    rtt.sample(10)
+    assert rtt.timeout == 2
+    # A lower bound above initial, like the election timeout, gives initial
+    rtt = RttEstimator(2, 5)
+    rtt.sample(0.01)
+    assert rtt.timeout == 2
@@ -0,0 +1,65 @@
+import math
+
+from learning.detector import PhiAccrualDetector
+
+
+def regular(detector, id, interval=0.1, count=50):
+    """Heartbeats of node id every interval seconds, returns the last one"""
+    for beat in range(count):
+        detector.heartbeat(id, beat*interval)
+    return (count - 1)*interval
+
+
+def test_unknown_node():
+    detector = PhiAccrualDetector(3)
+    assert not detector.known(0)
+    assert detector.phi(0, 100) == 0
+    # A single heartbeat has no inter-arrival time yet
+    detector.heartbeat(0, 1)
+    assert not detector.known(0)
+    assert detector.phi(0, 100) == 0
+
+
+def test_phi_grows_with_silence():
+    detector = PhiAccrualDetector(3)
+    last = regular(detector, 1)
+    assert detector.known(1) and not detector.known(0)
+    assert detector.phi(1, last) < 0.01
+    phis = [detector.phi(1, last + silence) for silence in (0.05, 0.1, 0.2, 0.3, 0.4)]
+    assert all(a < b for a, b in zip(phis, phis[1:]))
+    # A missed heartbeat is suspicious, a few are a failure
+    assert phis[2] > 1
+    assert phis[4] > 8
+    assert detector.phi(1, last + 10) == math.inf
+    # Node 1 is suspected, node 0 is not
+    assert detector.phi(0, last + 10) == 0
+
+
+def test_heartbeat_clears_suspicion():
+    detector = PhiAccrualDetector(1)
+    last = regular(detector, 0)
+    assert detector.phi(0, last + 1) > 8
+    detector.heartbeat(0, last + 1)
+    # The long gap widens the distribution, the next heartbeat is on time
+    assert detector.phi(0, last + 1.1) < 1
+
+
+def test_window_forgets_old_intervals():
+    detector = PhiAccrualDetector(1, window=10)
+    last = regular(detector, 0, interval=1)
+    for beat in range(1, 11):
+        detector.heartbeat(0, last + beat*0.1)
+    last += 1
+    assert detector.phi(0, last + 0.1) < 1
+    assert detector.phi(0, last + 0.5) > 8
+
+
+def test_reset():
+    detector = PhiAccrualDetector(1)
+    last = regular(detector, 0, interval=0.1)
+    detector.reset(0, last, 2)
+    assert detector.known(0)
+    # The 0.1 s history is gone, the next heartbeat is expected in 2 s
+    assert detector.phi(0, last + 1) < 0.01
+    assert detector.phi(0, last + 2) < 0.5
+    assert detector.phi(0, last + 3) > 8
@@ -0,0 +1,96 @@
+from learning.election import VoteTally
+
+
+def test_quorum():
+    tally = VoteTally(5, 0)
+    tally.vote(1, [2, 3])
+    tally.vote(2, [3, 4])
+    assert tally.voters() == 2
+    assert tally.decide(3) is None
+    tally.vote(3, [3])
+    assert tally.decide(3) == 3
+    # Decided, the same leader is not announced twice
+    assert tally.decide(3) is None
+    assert tally.winner == 3
+
+
+def test_lowest_id_wins_ties():
+    tally = VoteTally(5, 0)
+    tally.vote(1, [4, 2])
+    tally.vote(2, [2, 4])
+    tally.vote(3, [1])
+    assert tally.leading() == 2
+    assert tally.decide(3) == 2
+
+
+def test_voter_replaces_its_ballot():
+    tally = VoteTally(5, 0)
+    tally.vote(1, [2])
+    tally.vote(2, [2])
+    tally.vote(1, [3])
+    assert tally.voters() == 2
+    assert tally.votes.tolist() == [0, 0, 1, 1, 0]
+    tally.vote(2, [3])
+    assert tally.leading() == 3
+    assert tally.votes.tolist() == [0, 0, 0, 2, 0]
+
+
+def test_replaced_leader_cannot_win():
+    tally = VoteTally(4, 1)
+    for voter in range(4):
+        tally.vote(voter, [1, 3])
+    assert tally.votes[1] == 4
+    assert tally.leading() == 3
+
+
+def test_invalid_candidates_ignored():
+    tally = VoteTally(3, 0)
+    tally.vote(1, [-1, 2, 3])
+    assert tally.votes.tolist() == [0, 0, 1]
+
+
+def test_late_vote_changes_winner():
+    tally = VoteTally(5, 0)
+    tally.vote(1, [2])
+    tally.vote(2, [2])
+    tally.vote(3, [4])
+    assert tally.decide(3) == 2
+    tally.vote(4, [4])
+    tally.vote(0, [4])
+    assert tally.decide(3) == 4
+
+
+def test_new_round_decides_again():
+    tally = VoteTally(5, 0)
+    tally.vote(1, [2])
+    tally.vote(2, [2])
+    tally.vote(3, [2])
+    assert tally.decide(3) == 2
+    # 2 did not take over, voter 3 is down: its old ballot is dropped
+    tally.new_round()
+    assert tally.winner is None and tally.voters() == 0
+    tally.vote(1, [2])
+    tally.vote(2, [2])
+    assert tally.decide(3) is None
+    tally.vote(4, [2])
+    # The same winner is announced again
+    assert tally.decide(3) == 2
+
+
+def test_new_round_keeps_early_ballots():
+    tally = VoteTally(5, 0)
+    for voter in (1, 2, 3):
+        tally.vote(voter, [2])
+    assert tally.decide(3) == 2
+    # Voter 4 already started the next round before we did
+    tally.vote(4, [3])
+    tally.new_round()
+    assert tally.voters() == 1
+    assert tally.votes.tolist() == [0, 0, 0, 1, 0]
+
+
+def test_new_round_while_undecided():
+    tally = VoteTally(5, 0)
+    tally.vote(1, [2])
+    tally.new_round()
+    assert tally.voters() == 1
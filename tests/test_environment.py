@@ -0,0 +1,54 @@
+import math
+
+import numpy as np
+import pytest
+
+from learning.environment import sample_failures
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bounds_and_alive_only(seed):
+    rng = np.random.default_rng(seed)
+    n = 11
+    min_failed, max_failed = 0.8*5, 5
+    for _ in range(500):
+        p = rng.random(n)
+        alive = rng.random(n) < 0.8
+        down = n - np.count_nonzero(alive)
+        indices = sample_failures(rng, p, alive, min_failed, max_failed)
+        assert np.all(alive[indices])
+        assert len(np.unique(indices)) == len(indices)
+        if down >= min_failed:
+            assert len(indices) == 0
+        else:
+            assert math.ceil(min_failed) <= down + len(indices) <= max_failed
+
+
+def test_top_up_takes_never_failing_nodes_last():
+    rng = np.random.default_rng(0)
+    p = np.array([0.0, 0.0, 0.0, 1e-9, 1e-9])
+    alive = np.ones(5, dtype=bool)
+    for _ in range(100):
+        indices = sample_failures(rng, p, alive, 2, 2)
+        assert indices.tolist() == [3, 4]
+
+
+def test_marginal_rates_match_p():
+    # A node with p = 1 always fails, so there is never a top-up, and no cap
+    # below n: every alive node fails with its own probability
+    rng = np.random.default_rng(1)
+    p = np.array([0.05, 0.2, 0.5, 0.8, 1.0, 0.0])
+    alive = np.ones(len(p), dtype=bool)
+    rounds = 20000
+    counts = np.zeros(len(p))
+    for _ in range(rounds):
+        counts[sample_failures(rng, p, alive, 1, len(p))] += 1
+    np.testing.assert_allclose(counts/rounds, p, atol=0.015)
+
+
+def test_failed_nodes_are_not_sampled():
+    rng = np.random.default_rng(2)
+    p = np.full(6, 0.5)
+    alive = np.array([True, False, True, False, True, True])
+    for _ in range(1000):
+        assert not np.any(np.isin(sample_failures(rng, p, alive, 3, 4), [1, 3]))
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from learning.message import (
+    MESSAGE_TYPES, REQUEST_TYPES, ESTIMATES_FLOAT32, ESTIMATES_IDS32, ESTIMATES_SNAPSHOT, FRAME_HEADER,
+    ClientRequestMessage, RedirectMessage, ShareCandidatesMessage, ShareEstimatesMessage, FailureMessage,
+    decode, decode_frames, encode, parse_and_construct
+)
+
+
+def example(cls):
+    """A message of type cls with every field set"""
+    if cls is ClientRequestMessage:
+        return ClientRequestMessage(-1, 1, 1700000000123, 42, 1699999999001)
+    if cls in REQUEST_TYPES:
+        return cls(3, 1, 1700000000123, 42)
+    if cls is FailureMessage:
+        return FailureMessage(-2, 0, 1700000000123, "True")
+    if cls is ShareCandidatesMessage:
+        return ShareCandidatesMessage(3, 1, 1700000000123, np.array([4, 0, 2]))
+    if cls is ShareEstimatesMessage:
+        return ShareEstimatesMessage(3, 1, 1700000000123, np.array([0.1, 0.5, 0.25], dtype=np.float16),
+                                     np.array([3, 0, 7]))
+    return cls(3, 1, 1700000000123)
+
+
+def fields(message):
+    return {key: value.tolist() if isinstance(value, np.ndarray) else value
+            for key, value in vars(message).items()}
+
+
+@pytest.mark.parametrize('cls', MESSAGE_TYPES, ids=lambda cls: cls.__name__)
+def test_round_trip(cls):
+    message = example(cls)
+    data = encode(message)
+    decoded, end = decode(data)
+    assert end == len(data)
+    assert type(decoded) is cls
+    assert fields(decoded) == fields(message)
+
+
+@pytest.mark.parametrize('cls', MESSAGE_TYPES, ids=lambda cls: cls.__name__)
+def test_text_round_trip(cls):
+    message = example(cls)
+    decoded = parse_and_construct(str(message))
+    assert type(decoded) is cls
+    if cls in REQUEST_TYPES:
+        assert fields(decoded) == fields(message)
+
+
+def test_client_request_leader_stamp():
+    decoded, _ = decode(encode(example(ClientRequestMessage)))
+    assert decoded.stamp == 1700000000123
+    assert decoded.leaderStamp == 1699999999001
+    assert decoded.requestId == 42
+
+
+def test_redirect():
+    message = RedirectMessage(4, 7, 1700000000123, 2**31 - 1)
+    data = encode(message)
+    assert len(data) == FRAME_HEADER.size
+    decoded, _ = decode(data)
+    assert type(decoded) is RedirectMessage
+    assert (decoded.sender, decoded.leader, decoded.stamp, decoded.requestId) == (4, 7, 1700000000123, 2**31 - 1)
+
+
+def test_failure_value_false():
+    decoded, _ = decode(encode(FailureMessage(-2, 0, 5, "False")))
+    assert decoded.failureVal == "False"
+
+
+def flags(data):
+    return data[FRAME_HEADER.size]
+
+
+def test_estimates_snapshot_float16():
+    message = example(ShareEstimatesMessage)
+    data = encode(message)
+    assert flags(data) == ESTIMATES_SNAPSHOT
+    decoded, _ = decode(data)
+    assert decoded.ids is None
+    assert decoded.estimates.dtype == np.float16
+
+
+def test_estimates_float32_delta():
+    message = ShareEstimatesMessage(3, 1, 5, np.array([0.123456, 0.9]), np.array([1, 2]), np.array([7, 2]))
+    data = encode(message)
+    assert flags(data) == ESTIMATES_FLOAT32
+    decoded, _ = decode(data)
+    assert decoded.ids.tolist() == [7, 2]
+    np.testing.assert_allclose(decoded.estimates, [0.123456, 0.9], rtol=1e-6)
+    assert decoded.counts.tolist() == [1, 2]
+
+
+def test_estimates_ids_above_uint16():
+    ids = np.array([3, 65535, 65536, 100000])
+    message = ShareEstimatesMessage(3, 1, 5, np.zeros(4, dtype=np.float16), np.arange(4), ids)
+    data = encode(message)
+    assert flags(data) == ESTIMATES_IDS32
+    decoded, _ = decode(data)
+    assert decoded.ids.tolist() == ids.tolist()
+    assert decoded.counts.tolist() == [0, 1, 2, 3]
+
+
+def test_estimates_ids_uint16_up_to_65535():
+    message = ShareEstimatesMessage(3, 1, 5, np.zeros(1, dtype=np.float16), np.ones(1), np.array([65535]))
+    data = encode(message)
+    assert flags(data) == 0
+    assert decode(data)[0].ids.tolist() == [65535]
+
+
+def test_estimates_negative_id():
+    message = ShareEstimatesMessage(3, 1, 5, np.zeros(1), np.ones(1), np.array([-1]))
+    with pytest.raises(ValueError):
+        encode(message)
+
+
+def test_decode_incomplete():
+    data = encode(example(ShareCandidatesMessage))
+    for end in (0, FRAME_HEADER.size - 1, FRAME_HEADER.size, len(data) - 1):
+        assert decode(data[:end]) == (None, 0)
+
+
+def test_decode_frames_concatenated_and_partial():
+    messages = [example(cls) for cls in MESSAGE_TYPES]
+    data = b''.join(encode(message) for message in messages)
+    # Split the stream at every byte, like reads of a socket could
+    for split in range(len(data) + 1):
+        first, consumed = decode_frames(data[:split])
+        rest = data[consumed:split] + data[split:]
+        second, consumed_rest = decode_frames(rest)
+        assert consumed_rest == len(rest)
+        decoded = first + second
+        assert [type(message) for message in decoded] == MESSAGE_TYPES
+        assert [fields(message) for message in decoded] == [fields(message) for message in messages]
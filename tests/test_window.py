@@ -0,0 +1,72 @@
+import numpy as np
+
+from learning.window import RequestWindow
+
+
+def test_in_order():
+    window = RequestWindow(4)
+    for id in range(10):
+        assert id not in window
+        window.add(id)
+        assert id in window
+    assert window.low == 10
+    assert 10 not in window
+
+
+def test_watermark_waits_for_gaps():
+    window = RequestWindow(8)
+    window.add(0)
+    window.add(2)
+    window.add(3)
+    assert window.low == 1
+    assert 1 not in window and 2 in window and 3 in window
+    window.add(1)
+    assert window.low == 4
+    assert all(id in window for id in range(4))
+    assert 4 not in window
+
+
+def test_ring_wrap_around():
+    window = RequestWindow(4)
+    window.add(1)
+    window.add(3)
+    # 5 wraps onto the bit of 1, which is still above the watermark 0
+    assert 5 not in window
+    window.add(0)
+    assert window.low == 2
+    window.add(5)
+    assert 5 in window and 4 not in window and 2 not in window
+    window.add(2)
+    window.add(4)
+    assert window.low == 6
+    assert all(id in window for id in range(6))
+    assert 6 not in window and 9 not in window
+
+
+def test_far_ahead_moves_watermark():
+    window = RequestWindow(4)
+    window.add(0)
+    window.add(2)
+    # Does not fit the ring: the watermark moves up to 10 - 4 + 1 = 7 and
+    # the unseen IDs below it count as seen
+    window.add(10)
+    assert window.low == 7
+    assert 1 in window and 6 in window
+    assert 7 not in window and 8 not in window and 9 not in window
+    assert 10 in window
+    window.add(100)
+    assert window.low == 97
+    assert 10 in window and 98 not in window and 100 in window
+
+
+def test_matches_set():
+    rng = np.random.default_rng(0)
+    window = RequestWindow(16)
+    seen = set()
+    for id in np.arange(500) + rng.integers(-8, 8, 500):
+        id = max(int(id), 0)
+        window.add(id)
+        seen.add(id)
+        # Exact for the IDs at or above the watermark
+        for other in range(window.low, window.low + window.size):
+            assert (other in window) == (other in seen)
@@ -1,11 +1,19 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
+import atexit
 import bz2
-import pickle
+import glob
+import itertools
+import json
+import logging
+import logging.handlers
+import os
 import _pickle as cPickle
 import pathlib
+import queue
+import threading
+import time
+from os.path import join
 
 
 def make_dirs(path):
@@ -23,57 +31,411 @@ def decompress_pickle(file):
     return data
 
 
+class GrowableArray():
+    def __init__(self, row, capacity=1024) -> None:
+        """Array of rows with amortized O(1) append.
+
+        Rows are written into a preallocated buffer whose capacity doubles
+        when full, data is a view of the rows appended so far. The dtype is
+        promoted like np.concatenate would.
+
+            row: first row, sets the shape of the rows
+            capacity: initial number of rows
+        """
+        row = np.asarray(row)
+        self.buffer = np.empty((capacity,) + row.shape, dtype=row.dtype)
+        self.size = 0
+        self.append(row)
+
+    def append(self, row):
+        row = np.asarray(row)
+        dtype = np.promote_types(self.buffer.dtype, row.dtype)
+        if dtype != self.buffer.dtype:
+            self.buffer = self.buffer.astype(dtype)
+        if self.size == len(self.buffer):
+            self.buffer = np.concatenate([self.buffer, np.empty_like(self.buffer)])
+        self.buffer[self.size] = row
+        self.size += 1
+
+    @property
+    def data(self):
+        return self.buffer[:self.size]
+
+
+class ChunkedArray():
+    def __init__(self, path, row, chunk_size=1024, flush_sec=10, meta=None, dtype=np.float64) -> None:
+        """Append-only array of rows streamed to disk in chunks.
+
+        Rows are buffered in a preallocated chunk of chunk_size rows that is
+        appended to path.bin when full, or on the first append flush_sec
+        seconds after the last write, so at most one chunk is held in memory
+        and a crash only loses the rows of the current chunk. path.json holds
+        the row shape and meta, load_chunked() memory-maps the file.
+
+            path: file path without extension
+            row: first row, sets the shape of the rows
+            chunk_size: number of rows buffered in memory
+            flush_sec: maximum time rows stay in the buffer
+            meta: json serializable dict stored with the array
+            dtype: dtype of the rows, may be structured
+        """
+        row = np.asarray(row, dtype=dtype)
+        self.path = path
+        self.chunk = np.empty((chunk_size,) + row.shape, dtype=row.dtype)
+        self.size = 0
+        self.flush_sec = flush_sec
+        self.flushed = time.time()
+        self.lock = threading.Lock()
+        with open(path + '.json', 'w') as f:
+            json.dump({'dtype': np.lib.format.dtype_to_descr(row.dtype), 'shape': row.shape,
+                       'meta': meta or {}}, f)
+        self.file = open(path + '.bin', 'wb')
+        self.append(row)
+
+    def append(self, row):
+        with self.lock:
+            self.chunk[self.size] = row
+            self.size += 1
+            if self.size == len(self.chunk) or time.time() - self.flushed > self.flush_sec:
+                self._flush()
+
+    def _flush(self):
+        if self.file.closed:
+            return
+        self.file.write(self.chunk[:self.size].tobytes())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size = 0
+        self.flushed = time.time()
+
+    def flush(self):
+        """Write the buffered rows to disk"""
+        with self.lock:
+            self._flush()
+
+    @property
+    def data(self):
+        self.flush()
+        return load_chunked(self.path)[0]
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+
+def load_chunked(path):
+    """Memory-map an array written by ChunkedArray, returns (rows, meta).
+
+    Only whole rows are returned, so the file of an interrupted run can be
+    read as is.
+    """
+    with open(path + '.json') as f:
+        info = json.load(f)
+    dtype = info['dtype']
+    dtype = np.dtype([tuple(field) for field in dtype] if isinstance(dtype, list) else dtype)
+    shape = tuple(info['shape'])
+    rows = os.path.getsize(path + '.bin') // (dtype.itemsize * int(np.prod(shape)))
+    if rows == 0:
+        return np.empty((0,) + shape, dtype=dtype), info['meta']
+    return np.memmap(path + '.bin', dtype=dtype, mode='r', shape=(rows,) + shape), info['meta']
+
+
+def load_log(file):
+    """Load the data a logger saved to file.
+
+    If the logger streamed to disk instead (no .pbz2 but a .json next to it),
+    the rows are memory-mapped and split like save() would have.
+    """
+    path = os.path.splitext(file)[0]
+    if os.path.exists(file) or not os.path.exists(path + '.json'):
+        return decompress_pickle(file)
+    rows, meta = load_chunked(path)
+    if not meta.get('stamped', False):
+        return rows
+    return [rows[:, 0], rows[:, 1:]] + [np.asarray(extra) for extra in meta.get('extra', [])]
+
+
+def stream_kwargs(config, exp_name, name):
+    """Logger kwargs to stream to exp_name/name if config.log.stream is set"""
+    log = config.get('log', {})
+    if not log.get('stream', False):
+        return {}
+    make_dirs(exp_name)
+    return {
+        'path': join(exp_name, name),
+        'chunk_size': log.get('chunk_size', 1024),
+        'flush_sec': log.get('flush_sec', 10)
+    }
+
+
+def log_array(row, path=None, chunk_size=1024, flush_sec=10, meta=None):
+    """Rows of a logger, in memory or streamed to path if given"""
+    if path is None:
+        return GrowableArray(row)
+    return ChunkedArray(path, row, chunk_size, flush_sec, meta)
+
+
+TRACE_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('node', '<i2'),
+    ('event', 'u1'),
+    ('message', 'u1'),
+    ('peer', '<i2'),
+    ('request', '<i4'),
+    ('leader', '<i4'),
+])
+TRACE_EVENTS = ['SEND', 'RECV']
+TRACE_SEND = 0
+TRACE_RECV = 1
+
+
+class EventTrace():
+    def __init__(self, path, chunk_size=4096, flush_sec=10, meta=None) -> None:
+        """Binary trace of the messages a component sends and receives.
+
+        Every event is one TRACE_DTYPE row (time, node, event, message type,
+        peer, requestId, leader) of a ChunkedArray at path, created on the
+        first event. Events recorded after close are dropped.
+
+            path: file path without extension
+            chunk_size: number of events buffered in memory
+            flush_sec: maximum time events stay in the buffer
+            meta: json serializable dict stored with the trace
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_sec = flush_sec
+        self.meta = meta
+        self.events = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def record(self, time, node, event, message, peer, request=-1, leader=-1):
+        row = (time, node, event, message, peer, request, leader)
+        with self.lock:
+            if self.closed:
+                return
+            if self.events is None:
+                self.events = ChunkedArray(self.path, row, self.chunk_size, self.flush_sec,
+                                           self.meta, dtype=TRACE_DTYPE)
+            else:
+                self.events.append(row)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.events is not None:
+                self.events.close()
+
+
+def event_trace(config, exp_name, name, meta=None):
+    """EventTrace to exp_name/trace_<name> if config.log.trace is set, else None"""
+    log = config.get('log', {})
+    if not log.get('trace', False):
+        return None
+    make_dirs(exp_name)
+    return EventTrace(join(exp_name, 'trace_{}'.format(name)), log.get('trace_chunk_size', 4096),
+                      log.get('flush_sec', 10), meta)
+
+
+def load_trace(exp_name):
+    """Events of all traces of a run sorted by time, returns (events, meta).
+
+    events is a TRACE_DTYPE array, meta the meta of the traces (e.g. the
+    message type names).
+    """
+    traces = [load_chunked(os.path.splitext(file)[0])
+              for file in sorted(glob.glob(join(exp_name, 'trace_*.json')))]
+    if not traces:
+        return np.empty(0, dtype=TRACE_DTYPE), {}
+    events = np.concatenate([events for events, _ in traces])
+    meta = {}
+    for _, trace_meta in traces:
+        meta.update(trace_meta)
+    return events[np.argsort(events['time'], kind='stable')], meta
+
+
+def record_tags(message):
+    """Tags of a log message, [SEND, FailEst] for "[SEND][FailEst UP] ..."
+    (empty if untagged)"""
+    tags = []
+    if not isinstance(message, str):
+        return tags
+    start = 0
+    while message.startswith('[', start) and message.find(']', start) > 0:
+        end = message.find(']', start)
+        tags.append(message[start + 1:end].split(' ')[0])
+        start = end + 1
+    return tags
+
+
+class TagFilter(logging.Filter):
+    def __init__(self, levels=None, sample=None):
+        """Drop log records by the tags of their message, the strictest
+        setting of the tags applies.
+
+            levels: tag -> minimum level (name or number) of its records
+            sample: tag -> keep one of every that many records
+        """
+        super().__init__()
+        self.levels = {tag: logging.getLevelName(level) if isinstance(level, str) else level
+                       for tag, level in (levels or {}).items()}
+        self.sample = dict(sample or {})
+        # next() on a count is atomic, records arrive from several threads
+        self.counts = {tag: itertools.count(1) for tag in self.sample}
+
+    def filter(self, record):
+        tags = record_tags(record.msg)
+        if not tags:
+            return True
+        if record.levelno < max(self.levels.get(tag, 0) for tag in tags):
+            return False
+        sampled = [tag for tag in tags if tag in self.sample]
+        if sampled:
+            tag = max(sampled, key=self.sample.get)
+            return next(self.counts[tag]) % self.sample[tag] == 1 % self.sample[tag]
+        return True
+
+
+class SnapshotQueueHandler(logging.handlers.QueueHandler):
+    """Queue records without formatting them, the listener thread does.
+    Array arguments are copied so that they are logged as they were."""
+    def prepare(self, record):
+        if record.exc_info or record.stack_info:
+            return super().prepare(record)
+        if isinstance(record.args, tuple):
+            record.args = tuple(a.copy() if isinstance(a, np.ndarray) else a for a in record.args)
+        return record
+
+
+def setup_logging(config, format, file, console=True):
+    """Log to file (and the console) like logging.basicConfig, the first
+    configuration of the process wins.
+
+    config.log.levels and config.log.sample filter records by tag (see
+    TagFilter). With config.log.background the handlers run on a thread fed
+    by a queue, so that formatting and I/O leave the caller.
+
+    Returns
+    -------
+        listener (QueueListener): background thread, None if synchronous or
+            already configured
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    log = config.get('log', {})
+    formatter = logging.Formatter(format, datefmt='%Y-%m-%d %H:%M:%S')
+    handlers = [logging.FileHandler(file)]
+    if console and log.get('console', True):
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root.setLevel(logging.INFO)
+    root.addFilter(TagFilter(log.get('levels'), log.get('sample')))
+    if not log.get('background', False):
+        for handler in handlers:
+            root.addHandler(handler)
+        return None
+    listener = logging.handlers.QueueListener(queue.SimpleQueue(), *handlers)
+    root.addHandler(SnapshotQueueHandler(listener.queue))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
 class ViewChangeLogger():
-    def __init__(self, stamp, total_nodes) -> None:
+    def __init__(self, stamp, total_nodes, path=None, chunk_size=1024, flush_sec=10) -> None:
         self.start_stamp = stamp
         self.total_nodes = total_nodes
-        self.data = np.array([[self.start_stamp, 0]])
+        self.rows = log_array([self.start_stamp, 0], path, chunk_size, flush_sec)
+
+    @property
+    def data(self):
+        return self.rows.data
 
     def tick(self, stamp, value):
-        self.data = np.concatenate([self.data, np.array([[stamp, value]])])
+        self.rows.append([stamp, value])
 
     def save(self, file):
-        compress_pickle(file, self.data)
+        if isinstance(self.rows, ChunkedArray):
+            self.rows.close()
+        else:
+            compress_pickle(file, self.data)
 
 
 class LeaderLogger():
-    def __init__(self, stamp) -> None:
+    def __init__(self, stamp, path=None, chunk_size=1024, flush_sec=10) -> None:
         self.start_stamp = stamp
-        self.data = np.array([[self.start_stamp, 0, 0]])
+        self.rows = log_array([self.start_stamp, 0, 0], path, chunk_size, flush_sec)
+
+    @property
+    def data(self):
+        return self.rows.data
 
     def tick(self, stamp, leader, status):
-        self.data = np.concatenate([self.data, np.array([[stamp, leader, status]])])
+        self.rows.append([stamp, leader, status])
 
     def save(self, file):
-        compress_pickle(file, self.data)
+        if isinstance(self.rows, ChunkedArray):
+            self.rows.close()
+        else:
+            compress_pickle(file, self.data)
 
 
 class FailureLogger():
-    def __init__(self, stamp, total_nodes, true_probs) -> None:
+    def __init__(self, stamp, total_nodes, true_probs, path=None, chunk_size=1024, flush_sec=10) -> None:
         self.start_stamp = stamp
         self.total_nodes = total_nodes
-        self.data_stamp = np.array([self.start_stamp])
-        self.data = np.array([[0]*total_nodes])
         self.true = true_probs
+        # Each row is the stamp followed by the failed nodes
+        meta = {'stamped': True, 'extra': [np.asarray(true_probs).tolist()]}
+        self.rows = log_array([self.start_stamp] + [0]*total_nodes, path, chunk_size, flush_sec, meta)
+
+    @property
+    def data_stamp(self):
+        return self.rows.data[:, 0]
+
+    @property
+    def data(self):
+        return self.rows.data[:, 1:]
 
     def tick(self, stamp, value):
-        self.data_stamp = np.concatenate([self.data_stamp, np.array([stamp])])
-        self.data = np.concatenate([self.data, np.array([value])])
+        self.rows.append(np.concatenate([[stamp], value]))
 
     def save(self, file):
-        compress_pickle(file, [self.data_stamp, self.data, self.true])
+        if isinstance(self.rows, ChunkedArray):
+            self.rows.close()
+        else:
+            compress_pickle(file, [self.data_stamp, self.data, self.true])
 
 
 class FailureEstimatesLogger():
-    def __init__(self, stamp, failure_estimates) -> None:
+    def __init__(self, stamp, failure_estimates, path=None, chunk_size=1024, flush_sec=10) -> None:
         self.start_stamp = stamp
-        self.data_stamp = np.array([stamp])
-        self.data = np.array([failure_estimates])
+        # Each row is the stamp followed by the estimates
+        self.rows = log_array(np.concatenate([[stamp], failure_estimates]), path,
+            chunk_size, flush_sec, {'stamped': True})
+        # Ticked by the threads of a node outside of its estimates lock
+        self.lock = threading.Lock()
+
+    @property
+    def data_stamp(self):
+        return self.rows.data[:, 0]
+
+    @property
+    def data(self):
+        return self.rows.data[:, 1:]
 
     def tick(self, stamp, failure_estimates):
-        self.data_stamp = np.concatenate([self.data_stamp, np.array([stamp])])
-        self.data = np.concatenate([self.data, np.array([failure_estimates])])
+        with self.lock:
+            self.rows.append(np.concatenate([[stamp], failure_estimates]))
 
     def save(self, file):
         """For now, we just save. Matplotlib is not thread-safe :("""
-        compress_pickle(file, [self.data_stamp, self.data])
\ No newline at end of file
+        if isinstance(self.rows, ChunkedArray):
+            self.rows.close()
+        else:
+            compress_pickle(file, [self.data_stamp, self.data])
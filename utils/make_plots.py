@@ -11,11 +11,11 @@ import seaborn as sns
 from os.path import join
 import numpy as np
 
-import bz2
-import pickle
-import _pickle as cPickle
 import glob
 
+# Loads both .pbz2 logs and logs streamed in chunks (memory-mapped)
+from utils.logger import load_log
+
 plt.rcParams['xtick.direction'] = 'out'
 plt.rcParams['ytick.direction'] = 'out'
 plt.rcParams['axes.spines.top'] = False
@@ -42,15 +42,9 @@ plt.rcParams.update({
 matplotlib.rcParams['hatch.color'] = 'white'
 
 
-def decompress_pickle(file):
-    data = bz2.BZ2File(file, 'rb')
-    data = cPickle.load(data)
-    return data
-
-
 def plot_leader_elections(path, nodes_cnt, fmt='png'):
-    data = decompress_pickle(path)
-    client_log = decompress_pickle(join(args.path, 'leader_log.pbz2'))
+    data = load_log(path)
+    client_log = load_log(join(args.path, 'leader_log.pbz2'))
     failed_election_idxs = np.where(client_log[:, -1] == 1)[0]
 
     fig, ax = plt.subplots(dpi=200)
@@ -68,7 +62,7 @@ def plot_leader_elections(path, nodes_cnt, fmt='png'):
 
 
 def plot_fail_est(path, node_id, true_vals=None, fmt='png'):
-    data_stamp, data = decompress_pickle(path)
+    data_stamp, data = load_log(path)
     fig, ax = plt.subplots(dpi=200)
     clrs = sns.color_palette("husl", data.shape[-1])
     for idx, val in enumerate(range(data.shape[-1])):
@@ -86,8 +80,8 @@ def plot_fail_est(path, node_id, true_vals=None, fmt='png'):
 def plot_comparative_le(files, labels, fmt='png'):
     data, client_log, failed_election_idxs = {}, {}, {}
     for idx, f in enumerate(files):
-        data[labels[idx]] = decompress_pickle(join(f, "client_view_changes.pbz2"))
-        client_log[labels[idx]] = decompress_pickle(join(f, 'leader_log.pbz2'))
+        data[labels[idx]] = load_log(join(f, "client_view_changes.pbz2"))
+        client_log[labels[idx]] = load_log(join(f, 'leader_log.pbz2'))
         failed_election_idxs[labels[idx]] = np.where(client_log[labels[idx]][:, -1] == 1)[0]
 
     # Histogram plotting the frequency of delay between failure and electing a
@@ -203,7 +197,11 @@ if __name__=='__main__':
 
         print("Using True Failure Probs: {}".format(true_vals))
 
-        files = glob.glob(join(args.path, "failEst_*.pbz2"))
+        # Streamed logs have a .json/.bin pair instead of the .pbz2
+        files = sorted(set(
+            f.rsplit('.', 1)[0] + '.pbz2'
+            for f in glob.glob(join(args.path, "failEst_*.pbz2")) + glob.glob(join(args.path, "failEst_*.json"))
+        ))
         for f in files:
             node_id = f.split('/')[-1].split('_')[1].split('.')[0]
             plot_fail_est(f, node_id, true_vals, fmt=args.fmt)